@@ -1,13 +1,37 @@
+import time
+load_started_at = time.time() # loading time is reported in plugin_loaded
+
 import sublime, sublime_plugin
 import os
+import sys
+import re
+import stat
+import codecs
 import errno
+import heapq
+import math
+import fnmatch
+import json
+import threading
+from bisect import bisect_left, insort
+from collections import deque
 
 ST2 = int(sublime.version()) < 3000
 
 if ST2:
-	from send2trash import send2trash
+	import Queue as queue
+
+	intern_string = intern
 else:
-	from .send2trash import send2trash
+	import queue
+
+	intern_string = sys.intern
+	unichr = chr
+
+try:
+	import fcntl
+except ImportError: # Windows
+	fcntl = None
 
 #
 # Helpers
@@ -21,6 +45,20 @@ def mkdirp(path):
 		else:
 			pass
 
+def replace_file(src, dst):
+	if hasattr(os, 'replace'):
+		os.replace(src, dst)
+	else: # Python 2
+		os.rename(src, dst)
+
+def same_file(path, other_path):
+	if os.path.normcase(os.path.abspath(path)) == os.path.normcase(os.path.abspath(other_path)):
+		return True
+	try:
+		return os.path.samefile(path, other_path)
+	except (AttributeError, OSError): # no samefile on Windows with Python 2
+		return False
+
 def ensure_path_sep_at_end(path):
 	return os.path.join(path, '')
 
@@ -39,22 +77,213 @@ def all_region(view):
 def read_view(view):
 	return view.substr(all_region(view))
 
+COPY_BUFFER_SIZE = 1024*1024
+
+# Default permissions of new files, read once since os.umask can only be read by changing it
+file_creation_mode = None
+def new_file_mode():
+	global file_creation_mode
+	if file_creation_mode is None:
+		umask = os.umask(0)
+		os.umask(umask)
+		file_creation_mode = 0o666 & ~umask
+	return file_creation_mode
+
+# Writes go to a temporary file next to path, which replaces path only once it is complete
+# Files that replacing would change otherwise (hard links, other owners) or that can only be written
+# in place (the folder is not writable) are overwritten directly, like open(path, 'w') does
+class AtomicFile(object):
+	def __init__(self, path, fsync=False):
+		self.path = os.path.realpath(path) # write through symlinks instead of replacing them
+		self.fsync = fsync
+
+		self.temp_path = None
+		self.file = None
+
+	def must_write_in_place(self):
+		try:
+			st = os.stat(self.path)
+		except OSError:
+			return False # a new file
+
+		if st.st_nlink > 1:
+			return True # the other links would keep the old contents
+		if hasattr(os, 'getuid') and (st.st_uid != os.getuid() or st.st_gid != os.getgid()):
+			return True # the new file would belong to us
+		return False
+
+	def __enter__(self):
+		import tempfile # only loaded once something is saved, it imports random
+
+		if self.must_write_in_place():
+			self.file = open(self.path, 'wb')
+			return self.file
+
+		(dirname, basename) = os.path.split(self.path)
+		try:
+			(fd, self.temp_path) = tempfile.mkstemp(prefix='.'+basename+'.', suffix='.tmp', dir=dirname)
+		except OSError as e:
+			if e.errno not in (errno.EACCES, errno.EPERM):
+				raise
+			self.file = open(self.path, 'wb') # the file may still be writable
+			return self.file
+
+		self.file = os.fdopen(fd, 'wb')
+		return self.file
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		if self.temp_path is None: # written in place
+			try:
+				if exc_type is None:
+					self.file.flush()
+					if self.fsync:
+						os.fsync(self.file.fileno())
+			finally:
+				self.file.close()
+			return False
+
+		try:
+			if exc_type is None:
+				self.file.flush()
+				if self.fsync:
+					os.fsync(self.file.fileno())
+			self.file.close()
+
+			if exc_type is not None:
+				os.remove(self.temp_path)
+				return False
+
+			try:
+				mode = stat.S_IMODE(os.stat(self.path).st_mode)
+			except OSError:
+				mode = new_file_mode()
+			os.chmod(self.temp_path, mode)
+
+			replace_file(self.temp_path, self.path)
+			if self.fsync:
+				fsync_dir(os.path.dirname(self.path))
+		except:
+			if os.path.exists(self.temp_path):
+				os.remove(self.temp_path)
+			raise
+
+		return False
+
+def fsync_dir(dirname):
+	if os.name != 'posix':
+		return
+
+	fd = os.open(dirname, os.O_RDONLY)
+	try:
+		os.fsync(fd)
+	finally:
+		os.close(fd)
+
+# Encodes the view a chunk at a time, so the whole buffer never has to be in memory at once
+def write_view_chunks(view, fd, encoding):
+	encoder = codecs.getincrementalencoder(encoding)('strict')
+	chunk_size = config.write_chunk_size
+	translate_newlines = os.linesep != '\n' # what text mode files used to do
+
+	size = view.size()
+	for start in range(0, size, chunk_size):
+		chunk = view.substr(sublime.Region(start, min(start+chunk_size, size)))
+		if translate_newlines:
+			chunk = chunk.replace('\n', os.linesep)
+
+		fd.write(encoder.encode(chunk))
+	fd.write(encoder.encode('', True))
+
 def write_view_to_file(view, path):
+	started_at = span_start()
+
 	mkdirp(path)
+	wait_for_trash(path) # e.g. the file being overwritten
+	forget_stat(path)
 
 	if ST2:
-		with open(path, 'w') as fd:
-			fd.write(read_view(view))
+		with AtomicFile(path, config.fsync_on_save) as fd:
+			write_view_chunks(view, fd, 'UTF-8')
 
 		sublime.status_message('Saved: '+path)
 	else:
 		view_encoding = view.encoding()
 		save_encoding = view_encoding if view_encoding != 'Undefined' else 'UTF-8'
-		with open(path, 'w', encoding = save_encoding) as fd:
-			fd.write(read_view(view))
+		with AtomicFile(path, config.fsync_on_save) as fd:
+			write_view_chunks(view, fd, save_encoding)
 
 		sublime.status_message('Saved: '+path+' ('+save_encoding+')')
 
+	span_end('save', started_at)
+
+FICLONE = 0x40049409 # from linux/fs.h
+
+def kernel_copy(copy_range, src_fd, dst_fd, size):
+	offset = 0
+	while offset < size:
+		copied = copy_range(src_fd.fileno(), dst_fd.fileno(), offset, size-offset)
+		if copied == 0:
+			break
+		offset += copied
+
+def copy_file_range(src, dst, offset, count):
+	return os.copy_file_range(src, dst, count, offset, offset)
+
+def sendfile(src, dst, offset, count):
+	return os.sendfile(dst, src, offset, count)
+
+# Lets the filesystem or the kernel copy the data where possible, so it never reaches Python
+def copy_file_contents(src_fd, dst_fd):
+	if fcntl is not None and sys.platform.startswith('linux'):
+		try:
+			fcntl.ioctl(dst_fd.fileno(), FICLONE, src_fd.fileno()) # reflink, shares the blocks
+			return
+		except (IOError, OSError):
+			pass
+
+	size = os.fstat(src_fd.fileno()).st_size
+	for (name, copy_range) in (('copy_file_range', copy_file_range), ('sendfile', sendfile)):
+		if not hasattr(os, name):
+			continue
+
+		try:
+			kernel_copy(copy_range, src_fd, dst_fd, size)
+			return
+		except OSError:
+			# Not supported for these files, start over
+			dst_fd.seek(0)
+			dst_fd.truncate()
+
+	import shutil
+	src_fd.seek(0)
+	shutil.copyfileobj(src_fd, dst_fd, COPY_BUFFER_SIZE)
+
+def copy_file(src, dst):
+	mkdirp(dst)
+	wait_for_trash(dst)
+	forget_stat(dst)
+
+	with open(src, 'rb') as src_fd:
+		with AtomicFile(dst, config.fsync_on_save) as dst_fd:
+			copy_file_contents(src_fd, dst_fd)
+
+def move_file(src, dst):
+	mkdirp(dst)
+	wait_for_trash(dst)
+	forget_stat(src)
+	forget_stat(dst)
+
+	try:
+		replace_file(src, dst) # only metadata changes
+	except OSError as e:
+		if e.errno != errno.EXDEV:
+			raise
+		# Another filesystem (or bind mount, even on the same device)
+		copy_file(src, dst)
+		trash([src])
+
+	sublime.status_message('Moved: '+dst)
+
 def force_close_view(view):
 	view.set_scratch(True)
 
@@ -80,10 +309,123 @@ HOMEDIR_ABBR = ensure_path_sep_at_end('~')
 #
 # General
 #
-settings = {}
+SETTING_NAMES = [
+	'use_untitled_files',
+	'untitled_file_name',
+	'default_save_folder',
+	'overwrite_by_default',
+	'discard_by_default',
+	'discard_in_window_by_default',
+	'discard_on_exit_by_default',
+	'write_chunk_size',
+	'fsync_on_save',
+	'stat_timeout',
+	'stat_cache_ttl',
+	'delete_by_default',
+	'delete_without_prompt',
+	'trash_in_background',
+	'trash_index_size',
+	'close_on_deletion',
+	'allow_history',
+	'allow_history_in',
+	'use_global_history',
+	'cycle_history',
+	'history_prefix_search',
+	'history_max_size',
+	'persist_history',
+	'use_shell_like_autocomplete',
+	'autocomplete_matching',
+	'fuzzy_max_results',
+	'project_index',
+	'project_index_ttl',
+	'project_index_max_files',
+	'project_index_exclude_patterns',
+	'frecency_ranking',
+	'frecency_half_life_days',
+	'frecency_max_size',
+	'folder_priority',
+	'autocomplete_mode',
+	'inhibit_word_completions',
+	'inhibit_explicit_completions',
+	'listing_cache_entries',
+	'listing_cache_memory',
+	'prefetch_listings',
+	'right_arrow_override',
+	'right_arrow_default_command',
+	'right_arrow_default_args',
+	'performance_stats',
+	'completion_page_size'
+]
+
+# Settings as they were when last changed, with everything derived from them worked out
+# Hot paths (every key press) read this instead of going through the settings API
+class Config(object):
+	def __init__(self, settings):
+		values = {}
+		for name in SETTING_NAMES:
+			values[name] = settings.get('no_dialogs_'+name)
+
+		values['allow_history_in'] = frozenset(values['allow_history_in'] or [])
+		values['frecency_half_life'] = values['frecency_half_life_days'] * 24*60*60.0
+
+		# Rankers
+		values['ranker'] = terminal_ranker if values['use_shell_like_autocomplete'] else prefix_ranker
+		values['fuzzy_matching'] = values['autocomplete_matching'] == 'fuzzy' and not values['use_shell_like_autocomplete']
+
+		folder_priority = values['folder_priority']
+		if folder_priority == 'first':
+			values['dir_ranker'] = dir_lover_ranker
+		elif folder_priority == 'last':
+			values['dir_ranker'] = dir_hater_ranker
+		else:
+			values['dir_ranker'] = apathy_ranker
+
+		# This is what the no_dialogs_no_shell_like_autocomplete key binding context has always checked
+		values['no_shell_like_context'] = not settings.get('no_dialogs__shell_like_autocomplete')
+
+		self.__dict__.update(values)
+
+	def __setattr__(self, name, value):
+		raise AttributeError('Config is read-only, change the settings instead')
+
+# Settings are only loaded when one is first needed, not while Sublime Text is starting up
+class UnloadedConfig(object):
+	def __getattr__(self, name):
+		load_settings()
+		return getattr(config, name)
+
+settings = None
+config = UnloadedConfig()
+def compile_settings():
+	global config
+	config = Config(settings)
+
+def load_settings():
+	global settings
+	if settings is not None:
+		return
+
+	settings = sublime.load_settings('NoDialogs.sublime-settings')
+	settings.add_on_change('NoDialogs', compile_settings)
+	compile_settings()
+
 def plugin_loaded():
-    global settings
-    settings = sublime.load_settings('NoDialogs.sublime-settings')
+	print('[NoDialogs] Loaded in %.1fms' % ((time.time() - load_started_at)*1000))
+
+def plugin_unloaded():
+	if settings is not None:
+		settings.clear_on_change('NoDialogs')
+
+	prefetcher.stop()
+
+	for index in (project_index, project_index_rebuild):
+		if index is not None:
+			index.cancelled = True
+	project_indexer.stop()
+	data_writer.stop()
+	file_writer.stop()
+	trasher.stop()
+	stat_checker.stop()
 
 if ST2:
 	plugin_loaded()
@@ -93,9 +435,627 @@ class NoDialogsReplaceHelperCommand(sublime_plugin.TextCommand):
 		self.view.replace(edit, all_region(self.view), new_text)
 
 
+#
+# Background work
+#
+class WorkerPool(object):
+	def __init__(self, name, size):
+		self.name = name
+		self.size = size
+
+		self.tasks = queue.Queue()
+		self.threads = []
+
+	def start(self):
+		while len(self.threads) < self.size:
+			thread = threading.Thread(target=self.work, name='NoDialogs '+self.name)
+			thread.daemon = True
+			thread.start()
+
+			self.threads.append(thread)
+
+	def stop(self):
+		for _ in self.threads:
+			self.tasks.put(None)
+		self.threads = []
+
+	def work(self):
+		while True:
+			task = self.tasks.get()
+			if task is None:
+				return
+
+			(fn, args) = task
+			try:
+				fn(*args)
+			except Exception as e:
+				print('[NoDialogs] '+self.name+' task failed: '+str(e))
+
+	def submit(self, fn, *args):
+		self.start()
+		self.tasks.put((fn, args))
+
+
+#
+# Performance stats
+#
+# Timings of hot paths, each operation in a fixed-size log-scale histogram
+# When no_dialogs_performance_stats is off a span costs a check of config and nothing else
+timer = getattr(time, 'perf_counter', time.time)
+
+HISTOGRAM_BUCKETS_PER_DOUBLING = 4
+HISTOGRAM_BUCKETS = 128 # from 1us up to over an hour
+
+class Histogram(object):
+	def __init__(self):
+		self.counts = [0]*HISTOGRAM_BUCKETS
+		self.count = 0
+		self.max = 0.0
+
+	def record(self, seconds):
+		micros = seconds*1000000
+		bucket = int(math.log(micros, 2)*HISTOGRAM_BUCKETS_PER_DOUBLING) if micros > 1 else 0
+		self.counts[min(bucket, HISTOGRAM_BUCKETS-1)] += 1
+		self.count += 1
+		self.max = max(self.max, seconds)
+
+	# Upper bound of the bucket the percentile falls in, so within 19% of the real value
+	def percentile(self, fraction):
+		rank = fraction*self.count
+		seen = 0
+		for (bucket, count) in enumerate(self.counts):
+			seen += count
+			if seen >= rank and count:
+				return min(2**((bucket+1.0)/HISTOGRAM_BUCKETS_PER_DOUBLING)/1000000, self.max)
+		return self.max
+
+perf_stats = {} # operation -> Histogram
+perf_stats_lock = threading.Lock()
+
+def span_start():
+	if not config.performance_stats:
+		return None
+	return timer()
+
+def span_end(operation, started_at):
+	if started_at is None:
+		return
+	elapsed = timer()-started_at
+
+	with perf_stats_lock:
+		histogram = perf_stats.get(operation)
+		if histogram is None:
+			histogram = perf_stats[operation] = Histogram()
+		histogram.record(elapsed)
+
+def format_perf_stats():
+	with perf_stats_lock:
+		rows = [(operation, histogram.count, histogram.percentile(0.5), histogram.percentile(0.95), histogram.percentile(0.99), histogram.max) for (operation, histogram) in sorted(perf_stats.items())]
+
+	lines = ['%-12s %8s %10s %10s %10s %10s' % ('operation', 'count', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms')]
+	for row in rows:
+		lines.append('%-12s %8d %10.3f %10.3f %10.3f %10.3f' % (row[:2] + tuple(seconds*1000 for seconds in row[2:])))
+	return '\n'.join(lines)+'\n'
+
+
+#
+# File existence
+#
+# Checked on a few threads with a timeout, so one hung network mount can not block the UI,
+# and remembered for a moment, so checking many views at once does not stat the same file again
+STAT_CHECKER_THREADS = 4
+stat_checker = WorkerPool('stat checker', STAT_CHECKER_THREADS)
+stat_cache = {} # path -> (when, exists)
+stat_in_progress = {} # path -> when its check was queued
+stat_running = set() # paths in stat_in_progress a thread has picked up
+stat_condition = threading.Condition()
+
+def forget_stat(path):
+	with stat_condition:
+		stat_cache.pop(path, None)
+
+def check_exists(path):
+	with stat_condition:
+		stat_running.add(path)
+	exists = os.path.exists(path)
+	with stat_condition:
+		stat_in_progress.pop(path, None)
+		stat_running.discard(path)
+		stat_cache[path] = (time.time(), exists)
+		stat_condition.notify_all()
+
+# Returns path -> whether it exists, paths that hung past the timeout are left out
+# A path no thread got to in time was never checked, it is reported as not known to exist (False)
+def paths_exist(paths):
+	timeout = config.stat_timeout
+	ttl = config.stat_cache_ttl
+
+	results = {}
+	with stat_condition:
+		now = time.time()
+		deadline = now + timeout
+
+		pending = set()
+		to_check = []
+		for path in paths:
+			cached = stat_cache.get(path)
+			if cached is not None and now - cached[0] < ttl:
+				results[path] = cached[1]
+				continue
+
+			started = stat_in_progress.get(path)
+			if started is None:
+				stat_in_progress[path] = now
+				to_check.append(path)
+			elif now - started > timeout:
+				continue # already hung, neither retried nor waited for until it returns
+
+			pending.add(path)
+
+		# A thread for every check in progress, so none of them waits behind one stuck on a hung path
+		stat_checker.size = max(STAT_CHECKER_THREADS, len(stat_in_progress))
+		for path in to_check:
+			stat_checker.submit(check_exists, path)
+
+		while pending:
+			for path in list(pending):
+				cached = stat_cache.get(path)
+				if cached is not None and cached[0] >= now:
+					results[path] = cached[1]
+					pending.discard(path)
+
+			remaining = deadline - time.time()
+			if not pending or remaining <= 0:
+				break
+			stat_condition.wait(remaining)
+
+		for path in pending:
+			if path in stat_in_progress and path not in stat_running:
+				results[path] = False
+
+	for path in pending:
+		print('[NoDialogs] Timed out checking whether '+path+' exists')
+
+	return results
+
+# Paths that hung are assumed to exist
+def file_exists(path):
+	return paths_exist([path]).get(path, True)
+
+
+#
+# Plugin data
+#
+data_writer = WorkerPool('data writer', 1)
+
+def plugin_data_path(name):
+	if hasattr(sublime, 'cache_path'):
+		return os.path.join(sublime.cache_path(), 'NoDialogs', name)
+	return os.path.join(sublime.packages_path(), 'User', 'NoDialogs.'+name)
+
+def append_to_file(path, line):
+	mkdirp(path)
+	with open(path, 'a') as fd:
+		fd.write(line)
+
+def rewrite_file(path, lines):
+	mkdirp(path)
+
+	temp_path = path+'.tmp'
+	with open(temp_path, 'w') as fd:
+		fd.writelines(lines)
+	replace_file(temp_path, path)
+
+# A file of JSON records, one per line, only ever appended to until it is rewritten as a whole
+# Writes happen in order on data_writer, so a rewrite never loses an append queued before it
+class AppendLog(object):
+	def __init__(self, name):
+		self.name = name
+		self.line_count = 0
+
+	def path(self):
+		return plugin_data_path(self.name)
+
+	def read(self):
+		records = []
+		try:
+			with open(self.path()) as fd:
+				for line in fd:
+					self.line_count += 1
+					try:
+						records.append(json.loads(line))
+					except ValueError:
+						continue # torn write
+		except IOError as e:
+			if e.errno != errno.ENOENT:
+				print('[NoDialogs] Could not read '+self.name+': '+str(e))
+		return records
+
+	def append(self, record):
+		data_writer.submit(append_to_file, self.path(), json.dumps(record)+'\n')
+		self.line_count += 1
+
+	def rewrite(self, records):
+		lines = [json.dumps(record)+'\n' for record in records]
+		data_writer.submit(rewrite_file, self.path(), lines)
+		self.line_count = len(lines)
+
+
+#
+# Trash
+#
+# Files are trashed on a worker thread (trashing to another device is a full copy);
+# only writing to a path that is still waiting to be trashed has to wait for it
+trasher = WorkerPool('trash', 1)
+trash_condition = threading.Condition()
+trash_pending = {} # path key -> how many queued jobs trash it
+trash_pending_items = 0
+trash_started_at = None
+
+def trash_key(path):
+	return os.path.normcase(os.path.abspath(path))
+
+def show_trash_progress():
+	with trash_condition:
+		pending_items = trash_pending_items
+		started_at = trash_started_at
+
+	if not pending_items:
+		return
+
+	sublime.status_message('Moving to trash: '+str(pending_items)+' left ('+str(int(time.time() - started_at))+'s)')
+	sublime.set_timeout(show_trash_progress, 1000)
+
+def finish_trash_job(keys, item_count):
+	global trash_pending_items, trash_started_at
+	with trash_condition:
+		for key in keys:
+			trash_pending[key] -= 1
+			if not trash_pending[key]:
+				del trash_pending[key]
+
+		trash_pending_items -= item_count
+		if not trash_pending_items:
+			trash_started_at = None
+
+		trash_condition.notify_all()
+
+# Trashes right away and remembers where things went, so they can be restored
+# send2trash (and what it imports) is only loaded once something is trashed
+trash_module = None
+def load_send2trash():
+	global trash_module
+	if trash_module is None:
+		if ST2:
+			import send2trash as module
+		else:
+			from . import send2trash as module
+		trash_module = module
+	return trash_module
+
+def trash_now(paths):
+	send2trash = load_send2trash()
+
+	started_at = span_start()
+	try:
+		if len(paths) == 1:
+			location = send2trash.send2trash(paths[0])
+			trashed = [(paths[0],) + location] if location else []
+		else:
+			trashed = send2trash.send2trash_many(paths)
+	except (IOError, OSError) as e:
+		record_trashed(getattr(e, 'trashed', []))
+		raise
+	finally:
+		span_end('trash', started_at)
+
+	record_trashed(trashed)
+
+def run_trash_job(paths, keys):
+	try:
+		trash_now(paths)
+		if len(paths) == 1:
+			message = 'Moved to trash: '+paths[0]
+		else:
+			message = 'Moved to trash: '+str(len(paths))+' files'
+	except (IOError, OSError) as e:
+		message = 'Could not move to trash: '+str(e)
+		print('[NoDialogs] '+message)
+	finally:
+		for path in paths:
+			forget_stat(path)
+		finish_trash_job(keys, len(paths))
+
+	sublime.set_timeout(lambda: sublime.status_message(message), 0)
+
+def trash(paths):
+	if not config.trash_in_background:
+		trash_now(paths)
+		for path in paths:
+			forget_stat(path)
+		return
+
+	global trash_pending_items, trash_started_at
+	keys = [trash_key(path) for path in paths]
+	with trash_condition:
+		for key in keys:
+			trash_pending[key] = trash_pending.get(key, 0) + 1
+
+		if not trash_pending_items:
+			trash_started_at = time.time()
+			sublime.set_timeout(show_trash_progress, 0)
+		trash_pending_items += len(paths)
+
+	trasher.submit(run_trash_job, paths, keys)
+
+def wait_for_trash(path):
+	key = trash_key(path)
+	with trash_condition:
+		while key in trash_pending:
+			trash_condition.wait()
+
+# Trash index
+# What NoDialogs moved to trash, so it can be put back without reading every .trashinfo in the trash
+trash_index = deque() # [original path, trashed file, info file, when], most recent last
+trash_index_loaded = False
+trash_index_log = AppendLog('trash-index.log')
+trash_index_lock = threading.Lock()
+
+# Needs trash_index_lock
+def trim_trash_index():
+	max_size = config.trash_index_size
+	while len(trash_index) > max_size:
+		trash_index.popleft()
+
+	if trash_index_log.line_count > 2*max_size + 10:
+		trash_index_log.rewrite(list(trash_index))
+
+# Needs trash_index_lock
+def load_trash_index():
+	global trash_index_loaded
+	if trash_index_loaded:
+		return
+	trash_index_loaded = True
+
+	trash_index.extend(trash_index_log.read())
+	trim_trash_index()
+
+def record_trashed(trashed):
+	if not trashed:
+		return
+
+	now = time.time()
+	with trash_index_lock:
+		load_trash_index()
+
+		for (path, trashed_path, info_path) in trashed:
+			record = [os.path.abspath(path), trashed_path, info_path, now]
+			trash_index.append(record)
+			trash_index_log.append(record)
+
+		trim_trash_index()
+
+# Returns the restored paths, the path that was in the way and (path, error) for a file that could not be moved back
+# It stops at the first of those, which is left in the index
+# Runs on trasher, after every file queued to be trashed before it is in the index
+def restore_from_trash(count):
+	restored = []
+	in_the_way = None
+	failed = None
+	with trash_index_lock:
+		load_trash_index()
+
+		index_size = len(trash_index)
+		while len(restored) < count and trash_index:
+			(path, trashed_path, info_path, _) = trash_index[-1]
+
+			if not os.path.lexists(trashed_path): # the trash was emptied since
+				trash_index.pop()
+				continue
+			if os.path.lexists(path):
+				in_the_way = path
+				break
+
+			try:
+				mkdirp(path)
+				try:
+					os.rename(trashed_path, path)
+				except OSError as e:
+					if e.errno != errno.EXDEV:
+						raise
+					import shutil
+					shutil.move(trashed_path, path) # trashed to another device
+			except (IOError, OSError) as e:
+				failed = (path, e)
+				break
+			trash_index.pop()
+
+			try:
+				os.remove(info_path)
+			except OSError:
+				pass
+			restored.append(path)
+
+		if len(trash_index) != index_size:
+			trash_index_log.rewrite(list(trash_index))
+
+	return (restored, in_the_way, failed)
+
+
+#
+# Directory listing cache
+#
+def listing_memory(files):
+	return sys.getsizeof(files) + sum(sys.getsizeof(file) for file in files)
+
+# Least recently used listings are evicted first; there are few entries, so finding the oldest
+# one by going through all of them is cheap (and needs no OrderedDict, which ST2's Python 2.6 lacks)
+class ListingCache(object):
+	def __init__(self):
+		self.listings = {} # dirname -> [mtime, files, memory, when last used]
+		self.memory = 0
+		self.clock = 0
+
+	def discard(self, dirname):
+		entry = self.listings.pop(dirname, None)
+		if entry is not None:
+			self.memory -= entry[2]
+		return entry
+
+	def get(self, dirname, mtime):
+		entry = self.listings.get(dirname)
+		if entry is None:
+			return None
+		if entry[0] != mtime:
+			self.discard(dirname)
+			return None
+
+		self.clock += 1
+		entry[3] = self.clock
+		return entry[1]
+
+	def put(self, dirname, mtime, files):
+		self.discard(dirname)
+
+		memory = listing_memory(files)
+		self.clock += 1
+		self.listings[dirname] = [mtime, files, memory, self.clock]
+		self.memory += memory
+
+		self.evict()
+
+	def evict(self):
+		max_entries = config.listing_cache_entries
+		max_memory = config.listing_cache_memory
+
+		# The listing that was just added always stays, even if it alone is over the limits
+		while len(self.listings) > 1 and (len(self.listings) > max_entries or self.memory > max_memory):
+			oldest = min(self.listings, key=lambda dirname: self.listings[dirname][3])
+			self.discard(oldest)
+
+	def clear(self):
+		self.listings.clear()
+		self.memory = 0
+
+listing_cache = ListingCache()
+listing_lock = threading.Lock()
+listings_in_progress = {} # dirname -> threading.Event set once the listing is done
+
+# Returns the (shared, do not modify) list of entries in dirname
+# Folders end with a path separator, use is_dir_file_name instead of stat-ing them again
+def list_dir(dirname):
+	mtime = os.stat(dirname).st_mtime
+
+	with listing_lock:
+		files = listing_cache.get(dirname, mtime)
+		if files is not None:
+			return files
+
+		done = listings_in_progress.get(dirname)
+		if done is None:
+			done = threading.Event()
+			listings_in_progress[dirname] = done
+			in_progress_elsewhere = False
+		else:
+			in_progress_elsewhere = True
+
+	if in_progress_elsewhere:
+		# Most likely being prefetched right now, no need to list it twice
+		done.wait()
+		return list_dir(dirname)
+
+	try:
+		started_at = span_start()
+		files = scan_dir(dirname)
+		span_end('listing', started_at)
+
+		with listing_lock:
+			listing_cache.put(dirname, mtime, files)
+	finally:
+		with listing_lock:
+			del listings_in_progress[dirname]
+		done.set()
+
+	return files
+
+def entry_is_dir(entry):
+	try:
+		return entry.is_dir() # answered from d_type, only symlinks need a stat
+	except OSError:
+		return False
+
+def scan_dir(dirname):
+	if not hasattr(os, 'scandir'): # Python < 3.5
+		return [ensure_path_sep_at_end(file) if os.path.isdir(os.path.join(dirname, file)) else file for file in os.listdir(dirname)]
+
+	files = []
+	for entry in os.scandir(dirname):
+		if entry_is_dir(entry):
+			files.append(ensure_path_sep_at_end(entry.name))
+		else:
+			files.append(entry.name)
+
+	return files
+
+def is_dir_file_name(file):
+	return file.endswith(os.sep)
+
+# Prefetching
+prefetcher = WorkerPool('prefetcher', 1)
+prefetch_queued = set()
+prefetch_lock = threading.Lock()
+
+def prefetch_listing(dirname):
+	with prefetch_lock:
+		prefetch_queued.discard(dirname)
+
+	try:
+		list_dir(dirname)
+	except OSError:
+		pass # the path is still being typed
+
+def prefetch_path(raw_path):
+	if not config.prefetch_listings:
+		return
+
+	path = expand_homedir(raw_path)
+	if os.sep not in path:
+		return
+
+	dirname = path.rsplit(os.sep, 1)[0]
+	with prefetch_lock:
+		if dirname in prefetch_queued:
+			return
+		prefetch_queued.add(dirname)
+
+	prefetcher.submit(prefetch_listing, dirname)
+
+
 #
 # Autocomplete
 #
+# Ranking
+def apathy_ranker(_):
+	return 0
+
+def dir_lover_ranker(filename):
+	return 1 if is_dir_file_name(filename) else 0
+
+def dir_hater_ranker(filename):
+	return 1-dir_lover_ranker(filename)
+
+def prefix_ranker(basename, filename):
+	rank = 0
+	for a, b in zip(basename, filename):
+		if a != b:
+			return rank
+		else:
+			rank += 1
+	return rank
+
+def terminal_ranker(basename, filename):
+	return 1 if filename.startswith(basename) else 0
+
 def autocomplete_file_name(raw_path):
 	path = expand_homedir(raw_path)
 
@@ -103,84 +1063,338 @@ def autocomplete_file_name(raw_path):
 	dirname = path_parts[0]
 	basename = path_parts[1]
 
-	files = []
-	for file in os.listdir(dirname):
-		if os.path.isdir(os.path.join(dirname, file)):
-			files.append(ensure_path_sep_at_end(file))
-		else:
-			files.append(file)
+	files = list_dir(dirname)
 
-	if basename in files:
-		return [basename]
-	if not basename and not settings.get('no_dialogs_use_shell_like_autocomplete'):
-		return files
+	started_at = span_start()
+	matches = completion_session.matches_for(basename, files) if basename else None
+	completions = rank_file_names(dirname, basename, files, matches)
+	span_end('ranking', started_at)
 
-	# Ranking
-	def apathy_ranker(_):
-		return 0
+	return completions
 
-	def dir_lover_ranker(filename):
-		return 1 if os.path.isdir(os.path.join(dirname, file)) else 0
+def matching_file_names(basename, files):
+	if config.fuzzy_matching:
+		match = fuzzy_pattern(basename).match
+		return [filename for filename in files if match(filename)]
+	return [filename for filename in files if filename.startswith(basename)]
 
-	def dir_hater_ranker(filename):
-		return 1-dir_lover_ranker(filename)
+# Entries of the last listing that matched the last typed name
+# While the name only gets longer (the user is typing) the next matches are among them,
+# so the whole listing is not gone through again; another listing, or a changed one, starts over
+class CompletionSession(object):
+	def __init__(self):
+		self.reset()
 
-	def prefix_ranker(filename):
-		rank = 0
-		for a, b in zip(basename, filename):
-			if a != b:
-				return rank
-			else:
-				rank += 1
-		return rank
-
-	def terminal_ranker(filename):
-		return 1 if filename.startswith(basename) else 0
-
-	ranker = prefix_ranker
-	dir_ranker = apathy_ranker
-	if settings.get('no_dialogs_use_shell_like_autocomplete'):
-		ranker = terminal_ranker
-
-	folder_priority = settings.get('no_dialogs_folders_first')
-	if folder_priority == 'first':
-		dir_ranker = dir_lover_ranker
-	elif folder_priority == 'last':
-		dir_ranker = dir_hater_ranker
-
-	ranked = [(ranker(file), file, dir_ranker(file)) for file in files]
-
-	if not settings.get('no_dialogs_use_shell_like_autocomplete'):
-		ranked.sort(key = lambda entry: entry[2], reverse=True) # Folder priority
-	ranked.sort(key = lambda entry: entry[0], reverse=True) # Sort by rank
-
-	# Leave only entries with maximum rank
-	max_ranked = []
-	max_rank = ranked[0][0]
-	if max_rank != 0:
-		for rank, filename, _ in ranked:
-			if rank < max_rank:
-				break
+	def reset(self):
+		self.files = None
+		self.config = None
+		self.basename = None
+		self.matches = None
 
-			max_ranked.append(filename)
+	def matches_for(self, basename, files):
+		if files is self.files and config is self.config and basename.startswith(self.basename):
+			candidates = self.matches
+		else:
+			candidates = files
+
+		self.files = files
+		self.config = config
+		self.basename = basename
+		self.matches = matching_file_names(basename, candidates)
+		return self.matches
+
+completion_session = CompletionSession()
+
+# Completions handed out a page at a time
+# Ranked entries go into a heap (linear to build) and only the pages actually shown are popped off it,
+# so a directory of 200k files is not sorted as a whole to show its first few entries
+class CompletionPages(object):
+	# entries are completions in order, or (key..., completion) tuples to be ordered by key
+	def __init__(self, entries, ranked=False, limit=None):
+		if ranked:
+			heapq.heapify(entries)
+			self.heap = entries
+			self.taken = []
+		else:
+			self.heap = None
+			self.taken = entries # may be shared, never modified
+
+		self.size = len(entries) if limit is None else min(len(entries), limit)
+		self.dirname = '' # joined with every completion
+
+	def __len__(self):
+		return self.size
+
+	def __getitem__(self, index):
+		if index >= self.size:
+			raise IndexError(index)
+		if index >= len(self.taken):
+			self.take_until(index)
+		return os.path.join(self.dirname, self.taken[index])
+
+	def take_until(self, index):
+		page_size = config.completion_page_size
+		end = min(self.size, (index//page_size + 1)*page_size) # whole pages
+		heappop = heapq.heappop
+		while len(self.taken) < end:
+			self.taken.append(heappop(self.heap)[-1])
+
+	def first_page(self):
+		end = min(self.size, config.completion_page_size)
+		if end:
+			self[end-1]
+		return [os.path.join(self.dirname, completion) for completion in self.taken[:end]]
+
+# matches are the entries of files matching basename (see matching_file_names), None if basename is empty
+def rank_file_names(dirname, basename, files, matches):
+	if basename and basename in matches:
+		return CompletionPages([basename])
+
+	frecency_ranker = frecency_ranker_for(dirname)
+	if not basename and not config.use_shell_like_autocomplete:
+		if frecency_ranker is not None:
+			# Most used first, the rest stays in listing order
+			return CompletionPages([(-frecency_ranker(filename), index, filename) for (index, filename) in enumerate(files)], ranked=True)
+		return CompletionPages(files)
+
+	if config.fuzzy_matching:
+		return fuzzy_completions(basename, matches, config.dir_ranker, frecency_ranker or apathy_ranker, config.fuzzy_max_results)
+
+	if matches:
+		max_ranked = matches # all start with the name, nothing ranks higher
 	else:
-		max_ranked = [entry[1] for entry in ranked]
+		# Leave only entries with maximum rank
+		max_ranked = []
+		max_rank = 0
+		ranker = config.ranker
+		for filename in files:
+			rank = ranker(basename, filename)
+			if rank < max_rank:
+				continue
+			if rank > max_rank:
+				max_rank = rank
+				max_ranked = []
+			max_ranked.append(filename)
 
-	if settings.get('no_dialogs_use_shell_like_autocomplete'):
+		if max_rank == 0:
+			max_ranked = files
+
+	if config.use_shell_like_autocomplete:
 		prefix = os.path.commonprefix(max_ranked)
 		if not prefix:
-			return [basename]
+			return CompletionPages([basename])
 		else:
-			return [prefix]
+			return CompletionPages([prefix])
+	elif frecency_ranker is not None:
+		# Most used first, the rest sorted by name
+		return CompletionPages([(-frecency_ranker(filename), filename) for filename in max_ranked], ranked=True)
 	else:
-		max_ranked.sort() # Sort by name
+		return CompletionPages([(filename,) for filename in max_ranked], ranked=True)
+
+# Fuzzy matching
+FUZZY_WORD_SEPARATORS = frozenset([' ', '_', '-', '.', os.sep])
+
+FUZZY_MATCH_SCORE = 1
+FUZZY_CASE_BONUS = 1
+FUZZY_WORD_START_BONUS = 8
+FUZZY_CONTIGUOUS_BONUS = 4
+FUZZY_GAP_PENALTY = 1
+
+# Each step skips straight to the next occurrence of a character ([^x]*x), with '.*?' instead
+# a name that almost matches backtracks through every way of placing the characters
+def fuzzy_steps(query, skipped=''):
+	return ''.join('[^'+re.escape(char)+skipped+']*'+re.escape(char) for char in query)
+
+def fuzzy_pattern(query):
+	return re.compile(fuzzy_steps(query), re.IGNORECASE)
+
+# Scores the left-most match of query as a subsequence of candidate, None if it does not match
+def fuzzy_score(query, candidate):
+	query_len = len(query)
+	query_index = 0
+
+	score = 0
+	prev_char = None
+	prev_matched = False
+	for char in candidate:
+		if query_index == query_len:
+			break
+
+		wanted = query[query_index]
+		if char == wanted or char.lower() == wanted.lower():
+			score += FUZZY_MATCH_SCORE
+			if char == wanted:
+				score += FUZZY_CASE_BONUS
+			if prev_char is None or prev_char in FUZZY_WORD_SEPARATORS or (prev_char.islower() and char.isupper()):
+				score += FUZZY_WORD_START_BONUS
+			if prev_matched:
+				score += FUZZY_CONTIGUOUS_BONUS
+
+			query_index += 1
+			prev_matched = True
+		else:
+			if query_index > 0:
+				score -= FUZZY_GAP_PENALTY
+			prev_matched = False
+
+		prev_char = char
+
+	if query_index < query_len:
+		return None
+	return score
+
+# matches have already been through the fuzzy_pattern regex, which rejects most entries in C
+def fuzzy_completions(basename, matches, dir_ranker, frecency_ranker, max_results):
+	scored = []
+	for filename in matches:
+		score = fuzzy_score(basename, filename)
+		if score is not None:
+			scored.append((-score, -frecency_ranker(filename), -dir_ranker(filename), len(filename), filename))
+
+	if not scored:
+		return CompletionPages([basename])
+
+	return CompletionPages(scored, ranked=True, limit=max_results)
+
+#
+# Project index
+#
+
+def compile_exclude_patterns(patterns):
+	if not patterns:
+		return None
+	return re.compile('|'.join('(?:'+fnmatch.translate(pattern)+')' for pattern in patterns))
+
+class ProjectIndex(object):
+	def __init__(self, folders, folder_excludes, file_excludes, max_files):
+		self.folders = folders
+		self.folder_excludes = compile_exclude_patterns(folder_excludes)
+		self.file_excludes = compile_exclude_patterns(file_excludes)
+		self.max_files = max_files
+
+		# Directory i holds the files named in basenames[i], one per line
+		# basenames is always appended to first, so readers can go up to len(dirnames) while it is built
+		self.dirnames = [] # interned, ending with a path separator
+		self.basenames = []
+		self.file_count = 0
+
+		self.created_at = time.time()
+		self.done = False
+		self.cancelled = False
+
+	def is_excluded(self, excludes, name):
+		return excludes is not None and excludes.match(name) is not None
+
+	def build(self):
+		pending = [ensure_path_sep_at_end(folder) for folder in self.folders]
+		while pending and not self.cancelled:
+			dirname = pending.pop()
+
+			files = []
+			try:
+				for file in scan_dir(dirname):
+					if is_dir_file_name(file):
+						if not self.is_excluded(self.folder_excludes, file[:-1]):
+							pending.append(intern_string(dirname+file))
+					elif not self.is_excluded(self.file_excludes, file):
+						files.append(file)
+			except OSError:
+				continue # vanished or unreadable
+
+			if files:
+				self.basenames.append('\n'.join(files))
+				self.dirnames.append(intern_string(dirname))
+
+				self.file_count += len(files)
+				if self.file_count >= self.max_files:
+					print('[NoDialogs] Project index stopped at '+str(self.file_count)+' files')
+					break
+
+		self.done = True
+
+	def search(self, query, max_results):
+		# Finds whole lines matching the query as a subsequence, the scan itself happens in C
+		# Steps never skip past the end of a line, see fuzzy_steps
+		pattern = re.compile('^'+fuzzy_steps(query, '\\n')+'.*$', re.IGNORECASE | re.MULTILINE)
+
+		scored = []
+		for index in range(len(self.dirnames)):
+			for match in pattern.finditer(self.basenames[index]):
+				basename = match.group()
+
+				score = fuzzy_score(query, basename)
+				if score is not None:
+					scored.append((-score, len(basename), basename, index))
+
+		return [self.dirnames[entry[3]]+entry[2] for entry in heapq.nsmallest(max_results, scored)]
+
+project_indexer = WorkerPool('project indexer', 1)
+project_index = None
+project_index_rebuild = None
+
+def rebuild_project_index(new_index):
+	new_index.build()
+
+	global project_index, project_index_rebuild
+	if not new_index.cancelled:
+		project_index = new_index
+	project_index_rebuild = None
+
+def refresh_project_index(window):
+	if not config.project_index:
+		return
+
+	folders = window.folders()
+	if not folders:
+		return
+
+	global project_index, project_index_rebuild
+	if project_index is not None and project_index.folders == folders:
+		if not project_index.done or project_index_rebuild is not None:
+			return
+		if time.time() - project_index.created_at < config.project_index_ttl:
+			return
+
+	preferences = sublime.load_settings('Preferences.sublime-settings')
+	folder_excludes = (preferences.get('folder_exclude_patterns') or []) + config.project_index_exclude_patterns
+	file_excludes = (preferences.get('file_exclude_patterns') or []) + config.project_index_exclude_patterns
+	new_index = ProjectIndex(folders, folder_excludes, file_excludes, config.project_index_max_files)
+
+	if project_index is not None and project_index.folders == folders:
+		# Keep answering from the old index until the new one is complete
+		project_index_rebuild = new_index
+		project_indexer.submit(rebuild_project_index, new_index)
+		return
+
+	for stale_index in (project_index, project_index_rebuild):
+		if stale_index is not None:
+			stale_index.cancelled = True
+	project_index_rebuild = None
 
-		return max_ranked
+	# Searches use whatever has been indexed so far while this one is being built
+	project_index = new_index
+	project_indexer.submit(new_index.build)
+
+# Typing a name without any directory in the Open prompt searches the whole project
+def autocomplete_from_project_index(raw_path):
+	if currently_running_command != 'open' or not config.project_index:
+		return None
+	if not raw_path or os.sep in raw_path or raw_path.startswith('~') or project_index is None:
+		return None
+
+	completions = project_index.search(raw_path, config.fuzzy_max_results)
+	if not completions:
+		return [raw_path]
+	return [abbr_homedir(completion) for completion in completions]
 
 def autocomplete_path(path):
-	dirname = abbr_homedir(os.path.dirname(path))
+	completions = autocomplete_from_project_index(path)
+	if completions is not None:
+		return CompletionPages(completions)
 
-	return [os.path.join(dirname, completion) for completion in autocomplete_file_name(path)]
+	completions = autocomplete_file_name(path)
+	completions.dirname = abbr_homedir(os.path.dirname(path))
+	return completions
 
 def update_currently_open_prompt(view):
 	global currently_open_prompt
@@ -189,11 +1403,15 @@ def update_currently_open_prompt(view):
 	global history_index
 	history_index = -1 # when prompt changes history has to start over
 
+	completion_session.reset()
+
 	global glob_change_count
 	glob_change_count = 0
 
 def replace_view_text_with_edit(view, edit, new_text):
+	started_at = span_start()
 	view.replace(edit, all_region(view), new_text)
+	span_end('replace', started_at)
 
 	size = view.size()
 	sel = view.sel()
@@ -201,7 +1419,9 @@ def replace_view_text_with_edit(view, edit, new_text):
 	sel.add(sublime.Region(size, size))
 
 def replace_view_text(view, new_text):
+	started_at = span_start()
 	view.run_command('no_dialogs_replace_helper', {'new_text': new_text})
+	span_end('replace', started_at)
 
 def replace_prompt_text(new_text):
 	replace_view_text(currently_open_prompt, new_text)
@@ -212,11 +1432,13 @@ class NoDialogsAutocompleteNextCommand(sublime_plugin.TextCommand):
 		global next_completion
 		next_completion = True
 
-		self.view.run_command(settings.get('no_dialogs_right_arrow_default_command'), settings.get('no_dialogs_right_arrow_default_args'))
+		self.view.run_command(config.right_arrow_default_command, config.right_arrow_default_args)
 
 if ST2:
 	glob_change_count = 0
-def modification_counter(_):
+def modification_counter(text):
+	prefetch_path(text)
+
 	if not ST2:
 		return
 
@@ -233,9 +1455,14 @@ class NoDialogsTabTriggerCommand(sublime_plugin.TextCommand):
 		sublime_plugin.TextCommand.__init__(self, view)
 
 	def run(self, edit):
-		if settings.get('no_dialogs_autocomplete_mode') != 'tab_trigger':
+		if config.autocomplete_mode != 'tab_trigger':
 			return
 
+		started_at = span_start()
+		self.complete()
+		span_end('tab', started_at)
+
+	def complete(self):
 		text = read_view(self.view)
 
 		if ST2:
@@ -269,6 +1496,7 @@ class NoDialogsTabTriggerCommand(sublime_plugin.TextCommand):
 			if self.last_completion_index >= self.completions_count:
 				self.last_completion_index = 0
 
+			# Ranks the next page only once cycling gets past the ones shown so far
 			replace_prompt_text(self.completions[self.last_completion_index])
 		else:
 			self.last_change_count = None
@@ -285,13 +1513,109 @@ class NoDialogsTabTriggerCommand(sublime_plugin.TextCommand):
 # History
 #
 COMMANDS = ['save', 'copy', 'move', 'open']
-global_history = []
-save_history = []
-copy_history = []
-move_history = []
+
+class History(object):
+	def __init__(self, name):
+		self.name = name
+
+		self.entries = deque() # oldest first
+		self.sequence = {} # entry -> when it was last added, entries absent from it are not in the history
+
+		# Kept sorted, so entries sharing a prefix are next to each other
+		self.sorted_entries = []
+		self.next_sequence = 0
+
+	def add(self, entry):
+		if entry in self.sequence:
+			self.entries.remove(entry) # repeated entries move to the front
+		else:
+			insort(self.sorted_entries, entry)
+		self.entries.append(entry)
+
+		self.sequence[entry] = self.next_sequence
+		self.next_sequence += 1
+
+		max_size = config.history_max_size
+		while len(self.entries) > max_size:
+			self.remove_sorted(self.entries.popleft())
+
+	def remove_sorted(self, entry):
+		del self.sequence[entry]
+		del self.sorted_entries[bisect_left(self.sorted_entries, entry)]
+
+	# Entries starting with prefix, most recent first
+	def matching(self, prefix):
+		if not prefix:
+			return list(reversed(self.entries))
+
+		start = bisect_left(self.sorted_entries, prefix)
+		end = bisect_left(self.sorted_entries, prefix[:-1]+unichr(ord(prefix[-1])+1), start)
+
+		matches = self.sorted_entries[start:end]
+		matches.sort(key=self.sequence.__getitem__, reverse=True)
+		return matches
+
+	def __getitem__(self, index): # 0 is the most recent entry
+		return self.entries[-1-index]
+
+	def __len__(self):
+		return len(self.entries)
+
+global_history = History('global')
+save_history = History('save')
+copy_history = History('copy')
+move_history = History('move')
 history_index = -1
 history_current_edit = None
 
+# Persistence
+# Every added entry is appended to a log, which is rewritten once it gets much longer than the history itself
+HISTORIES = {
+	'global': global_history,
+	'save': save_history,
+	'copy': copy_history,
+	'move': move_history
+}
+history_loaded = False
+history_log = AppendLog('history.log')
+JSON_STRING = type(u'') # what json loads strings as, unicode on Python 2
+
+def load_history():
+	global history_loaded
+	if history_loaded:
+		return
+	history_loaded = True
+
+	if not config.persist_history:
+		return
+
+	for record in history_log.read():
+		# Lines that parse but are not [name, entry] are skipped like torn ones
+		if not isinstance(record, list) or len(record) != 2 or not all(isinstance(part, JSON_STRING) for part in record):
+			continue
+		(name, entry) = record
+
+		history = HISTORIES.get(name)
+		if history is not None:
+			history.add(entry)
+
+def persist_history(history, entry):
+	if not config.persist_history:
+		return
+
+	history_log.append([history.name, entry])
+
+	entry_count = sum(len(history) for history in HISTORIES.values())
+	if history_log.line_count > 2*entry_count + 100:
+		records = []
+		for history in HISTORIES.values():
+			records.extend([history.name, entry] for entry in history.entries)
+		history_log.rewrite(records)
+
+def add_to_named_history(history, entry):
+	history.add(entry)
+	persist_history(history, entry)
+
 def add_to_history(entry):
 	history_current_edit = None
 
@@ -299,23 +1623,26 @@ def add_to_history(entry):
 		print('[NoDialogs] !FIXME! No command is running, yet history is being updated')
 		return
 
-	if settings.get('no_dialogs_use_global_history'):
+	load_history()
+	record_frecency_visit(expand_homedir(entry))
+
+	if config.use_global_history:
 		if currently_running_command not in COMMANDS:
 			print('[NoDialogs] !FIXME! Unknown command is running '+currently_running_command)
 
 		global global_history
-		global_history.insert(0, entry)
+		add_to_named_history(global_history, entry)
 		return
 
 	if currently_running_command == 'save':
 		global save_history
-		save_history.insert(0, entry)
+		add_to_named_history(save_history, entry)
 	elif currently_running_command == 'copy':
 		global copy_history
-		copy_history.insert(0, entry)
+		add_to_named_history(copy_history, entry)
 	elif currently_running_command == 'move':
 		global move_history
-		move_history.insert(0, entry)
+		add_to_named_history(move_history, entry)
 	else:
 		print('[NoDialogs] !FIXME! Unknown command is running '+currently_running_command)
 		if currently_running_command not in COMMANDS:
@@ -326,9 +1653,11 @@ def retrive_history():
 		print('[NoDialogs] !FIXME! No command is running, yet history is being read')
 		return
 
+	load_history()
+
 	history = None
 
-	if settings.get('no_dialogs_use_global_history'):
+	if config.use_global_history:
 		if currently_running_command not in COMMANDS:
 			print('[NoDialogs] !FIXME! Unknown command is running '+currently_running_command)
 
@@ -357,26 +1686,43 @@ def read_from_history(index):
 def history_size():
 	return len(retrive_history())
 
+# Navigation
+history_matches = None # what Up/Down go through since navigation started, most recent first
+
+def text_before_cursor(view):
+	sel = view.sel()
+	end = sel[0].begin() if len(sel) > 0 else view.size()
+	return view.substr(sublime.Region(0, end))
+
+def start_history_navigation(view):
+	global history_current_edit
+	history_current_edit = read_view(view)
+
+	global history_matches
+	if config.history_prefix_search:
+		# Like a shell, only go through entries starting with what was typed
+		history_matches = retrive_history().matching(text_before_cursor(view))
+	else:
+		history_matches = retrive_history()
+
 class NoDialogsHistoryPreviousCommand(sublime_plugin.TextCommand):
 	def run(self, edit):
-		if not settings.get('no_dialogs_allow_history'):
+		if not config.allow_history:
 			return
-		if currently_running_command not in settings.get('no_dialogs_allow_history_in'):
+		if currently_running_command not in config.allow_history_in:
 			return
 
 		global history_index
+		if history_index == -1:
+			start_history_navigation(self.view)
 
-		hist_size = history_size()
+		hist_size = len(history_matches)
 		if hist_size == 0:
 			return
 
-		global history_current_edit
-		if history_index == -1:
-			history_current_edit = read_view(self.view)
-
 		history_index += 1
 		if history_index >= hist_size:
-			if settings.get('no_dialogs_cycle_history'):
+			if config.cycle_history:
 				history_index = -1
 			else:
 				history_index = hist_size-1
@@ -384,41 +1730,247 @@ class NoDialogsHistoryPreviousCommand(sublime_plugin.TextCommand):
 		if history_index == -1:
 			new_text = history_current_edit
 		else:
-			new_text = read_from_history(history_index)
+			new_text = history_matches[history_index]
 
 		replace_view_text_with_edit(self.view, edit, new_text)
 
 class NoDialogsHistoryNextCommand(sublime_plugin.TextCommand):
 	def run(self, edit):
-		if not settings.get('no_dialogs_allow_history'):
+		if not config.allow_history:
 			return
-		if currently_running_command not in settings.get('no_dialogs_allow_history_in'):
+		if currently_running_command not in config.allow_history_in:
 			return
 
 		global history_index
+		if history_index == -1:
+			start_history_navigation(self.view)
 
-		hist_size = history_size()
+		hist_size = len(history_matches)
 		if hist_size == 0:
 			return
 
 		history_index -= 1
 		if history_index < -1:
-			if settings.get('no_dialogs_cycle_history'):
+			if config.cycle_history:
 				history_index = hist_size-1
 			else:
 				history_index = -1
 
-		global history_current_edit
 		if history_index == -1:
 			new_text = history_current_edit
 		else:
-			new_text = read_from_history(history_index)
+			new_text = history_matches[history_index]
 
 		replace_view_text_with_edit(self.view, edit, new_text)
 
+#
+# Frecency
+#
+FRECENCY_FORGET_SCORE = 0.05
+
+class FrecencyTable(object):
+	# Scores are kept relative to epoch instead of being decayed one by one:
+	# a visit at time t adds 2^((t - epoch)/half_life), so comparing stored scores compares decayed ones.
+	# Once that exponent gets large every score is rebased to now, and forgotten paths are dropped.
+	def __init__(self):
+		self.scores = {}
+		self.epoch = time.time()
+
+	def visit(self, path, now, half_life):
+		exponent = (now - self.epoch) / half_life
+		if exponent > 32:
+			self.rebase(now, half_life)
+			exponent = 0
+
+		self.scores[path] = self.scores.get(path, 0) + 2 ** exponent
+
+	def rebase(self, now, half_life):
+		factor = 2 ** (-(now - self.epoch) / half_life)
+
+		scores = {}
+		for path, score in self.scores.items():
+			score *= factor
+			if score >= FRECENCY_FORGET_SCORE:
+				scores[path] = score
+
+		self.scores = scores
+		self.epoch = now
+
+	def trim(self, max_size):
+		if len(self.scores) <= max_size:
+			return
+
+		kept = heapq.nlargest(max_size, self.scores.items(), key=lambda item: item[1])
+		self.scores = dict(kept)
+
+	def score(self, path):
+		return self.scores.get(path, 0)
+
+	# Scores of the entries of dirname, by name with and without a trailing path separator
+	# Going through the (bounded) table is cheaper than looking up every entry of a big directory
+	def scores_in(self, dirname):
+		prefix = os.path.join(dirname, '')
+		scores = {}
+		for path, score in self.scores.items():
+			if path.startswith(prefix):
+				name = path[len(prefix):]
+				if name and os.sep not in name:
+					scores[name] = score
+					scores[name+os.sep] = score
+		return scores
+
+frecency = FrecencyTable()
+frecency_loaded = False
+frecency_save_queued = False
+
+def frecency_path():
+	return plugin_data_path('frecency.json')
+
+def load_frecency():
+	global frecency_loaded
+	if frecency_loaded:
+		return
+	frecency_loaded = True
+
+	try:
+		with open(frecency_path()) as fd:
+			data = json.load(fd)
+		frecency.epoch = data['epoch']
+		frecency.scores = data['scores']
+	except IOError as e:
+		if e.errno != errno.ENOENT:
+			print('[NoDialogs] Could not load frecency: '+str(e))
+	except (ValueError, KeyError):
+		print('[NoDialogs] Could not load frecency: corrupt file')
+
+def save_frecency():
+	global frecency_save_queued
+	frecency_save_queued = False
+
+	data = json.dumps({'epoch': frecency.epoch, 'scores': frecency.scores})
+
+	path = frecency_path()
+	mkdirp(path)
+
+	temp_path = path+'.tmp'
+	with open(temp_path, 'w') as fd:
+		fd.write(data)
+	replace_file(temp_path, path)
+
+def record_frecency_visit(path):
+	if not config.frecency_ranking:
+		return
+
+	load_frecency()
+
+	# Count the folder too, so the folders files are saved into rank higher
+	path = os.path.normpath(path)
+	now = time.time()
+	half_life = config.frecency_half_life
+	frecency.visit(path, now, half_life)
+	frecency.visit(os.path.dirname(path), now, half_life)
+	frecency.trim(config.frecency_max_size)
+
+	global frecency_save_queued
+	if not frecency_save_queued:
+		frecency_save_queued = True
+		data_writer.submit(save_frecency)
+
+# None if nothing in dirname was ever used
+def frecency_ranker_for(dirname):
+	if not config.frecency_ranking:
+		return None
+
+	load_frecency()
+
+	scores = frecency.scores_in(dirname)
+	if not scores:
+		return None
+
+	def frecency_ranker(filename):
+		return scores.get(filename, 0)
+
+	return frecency_ranker
+
+
 #
 # Save commands
 #
+def probable_dirname_and_basename(window, view):
+	basename = ''
+	dirname = ensure_path_sep_at_end(expand_homedir(config.default_save_folder))
+
+	view_name = view.name()
+	if view_name is not None and view_name:
+		basename = view_name
+	elif config.use_untitled_files:
+		basename = config.untitled_file_name
+
+	open_folders = window.folders()
+	if open_folders is not None and open_folders:
+		dirname = ensure_path_sep_at_end(open_folders[0])
+
+	return (abbr_homedir(dirname), basename)
+
+def reopen_from_path(window, view, path):
+	force_close_view(view)
+	window.open_file(path)
+
+def numbered_name(basename, number):
+	if number == 1:
+		return basename
+	(name, extname) = os.path.splitext(basename)
+	return name+' '+str(number)+extname
+
+# Creates an empty file at the first free path of 'name.ext', 'name 2.ext', 'name 3.ext'... from number on, and returns it
+# O_EXCL makes taking the name atomic, whatever created a file there in the meantime
+def create_new_file(dirname, basename, number):
+	mkdirp(os.path.join(dirname, basename))
+
+	while True:
+		path = os.path.join(dirname, numbered_name(basename, number))
+		try:
+			os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666))
+			return path
+		except OSError as e:
+			if e.errno != errno.EEXIST:
+				raise
+		number += 1
+
+# Views are written to new files at the same time, never over existing ones
+# jobs are (view, dirname, basename, number to start from), see create_new_file
+# on_done gets the (view, path) pairs that were written on the main thread
+file_writer = WorkerPool('file writer', 8)
+
+def write_views_to_new_files(jobs, on_done):
+	written = []
+	left = [len(jobs)]
+	lock = threading.Lock()
+
+	def write(view, dirname, basename, number):
+		path = None
+		try:
+			path = create_new_file(dirname, basename, number)
+			write_view_to_file(view, path)
+			with lock:
+				written.append((view, path))
+		except (IOError, OSError, UnicodeError) as e:
+			print('[NoDialogs] Could not save '+os.path.join(dirname, basename)+': '+str(e))
+			if path is not None and not os.path.getsize(path):
+				os.remove(path)
+		finally:
+			with lock:
+				left[0] -= 1
+				done = not left[0]
+			if done:
+				sublime.set_timeout(lambda: on_done(written), 0)
+
+	for job in jobs:
+		if ST2: # the API can only be used from the main thread
+			write(*job)
+		else:
+			file_writer.submit(write, *job)
+
 class NoDialogsCreateSavePromptCommand(sublime_plugin.ApplicationCommand):
 	def __init__(self):
 		self.window = None
@@ -451,31 +2003,14 @@ class NoDialogsCreateSavePromptCommand(sublime_plugin.ApplicationCommand):
 		self.path = None
 
 	def reopen_from_new_path(self):
-		force_close_view(self.view)
-		self.window.open_file(self.path)
+		reopen_from_path(self.window, self.view, self.path)
 		self.window.run_command('hide_panel')
 
 	def trash_file(self):
-		send2trash(self.path)
+		trash([self.path])
 
 	#
 	# Subroutines
-	def probable_dirname_and_basename(self):
-		basename = ''
-		dirname = ensure_path_sep_at_end(expand_homedir(settings.get('no_dialogs_default_save_folder')))
-
-		view_name = self.view.name()
-		if view_name is not None and view_name:
-			basename = view_name
-		elif settings.get('no_dialogs_use_untitled_files'):
-			basename = settings.get('no_dialogs_untitled_file_name')
-
-		open_folders = self.window.folders()
-		if open_folders is not None and open_folders:
-			dirname = ensure_path_sep_at_end(open_folders[0])
-
-		return (abbr_homedir(dirname), basename)
-
 	def finish_the_job(self):
 		add_to_history(abbr_homedir(self.path))
 
@@ -488,7 +2023,7 @@ class NoDialogsCreateSavePromptCommand(sublime_plugin.ApplicationCommand):
 	# Event handlers
 	def on_overwrite_answer(self, answer):
 		if not answer:
-			answer = settings.get('no_dialogs_overwrite_by_default')
+			answer = config.overwrite_by_default
 
 		if 'Nn'.find(answer[0]) != -1:
 			self.cleanup()
@@ -503,11 +2038,11 @@ class NoDialogsCreateSavePromptCommand(sublime_plugin.ApplicationCommand):
 		if os.path.isdir(self.path):
 			self.cleanup()
 			self.alias_window_and_view()
-			self.create_prompt(path, settings.get('no_dialogs_untitled_file_name'))
+			self.create_prompt(path, config.untitled_file_name)
 			return
 
 		if os.path.exists(self.path):
-			prompt = 'File exists. Overwrite? (defaults to '+settings.get('no_dialogs_overwrite_by_default')+')'
+			prompt = 'File exists. Overwrite? (defaults to '+config.overwrite_by_default+')'
 			self.window.show_input_panel(prompt, '', self.on_overwrite_answer, modification_counter, self.cleanup)
 			return
 
@@ -523,6 +2058,7 @@ class NoDialogsCreateSavePromptCommand(sublime_plugin.ApplicationCommand):
 		prefix = abbr_homedir(prefix)
 
 		default_text = os.path.join(prefix, selected_text) if selected_text else prefix
+		prefetch_path(default_text)
 		self.update_prompt(self.window.show_input_panel(self.PROMPT, default_text, self.on_done, modification_counter, self.on_cancel))
 
 		if selected_text:
@@ -544,7 +2080,7 @@ class NoDialogsCreateSavePromptCommand(sublime_plugin.ApplicationCommand):
 			self.resave()
 			return
 
-		(dirname, basename) = self.probable_dirname_and_basename()
+		(dirname, basename) = probable_dirname_and_basename(self.window, self.view)
 		self.create_prompt(dirname, basename)
 
 class NoDialogsCreateCopyPromptCommand(NoDialogsCreateSavePromptCommand):
@@ -553,14 +2089,20 @@ class NoDialogsCreateCopyPromptCommand(NoDialogsCreateSavePromptCommand):
 	def finish_the_job(self):
 		add_to_history(abbr_homedir(self.path))
 
-		write_view_to_file(self.view, self.path)
+		view_file_name = self.view.file_name()
+		wait_for_trash(self.path) # the overwritten file, the source is gone if it was that one
+		if view_file_name and not self.view.is_dirty() and os.path.exists(view_file_name):
+			copy_file(view_file_name, self.path) # the file already has the view's contents
+			sublime.status_message('Copied: '+self.path)
+		else:
+			write_view_to_file(self.view, self.path)
 		self.cleanup()
 
 	def run(self):
 		self.pre_run()
 
 		if not can_resave(self.view):
-			(dirname, basename) = self.probable_dirname_and_basename()
+			(dirname, basename) = probable_dirname_and_basename(self.window, self.view)
 			self.create_prompt(dirname, basename)
 			return
 
@@ -581,19 +2123,131 @@ class NoDialogsCreateMovePromptCommand(NoDialogsCreateCopyPromptCommand):
 	def finish_the_job(self):
 		add_to_history(abbr_homedir(self.path))
 
-		view_file_name = self.view.file_name() # destroy old copy
-		if view_file_name:
-			send2trash(view_file_name)
+		view_file_name = self.view.file_name()
+		wait_for_trash(self.path) # the overwritten file, the source is gone if it was that one
+		if view_file_name and not self.view.is_dirty() and os.path.exists(view_file_name):
+			move_file(view_file_name, self.path) # the file already has the view's contents
+		else:
+			if view_file_name and os.path.exists(view_file_name): # destroy old copy
+				trash([view_file_name])
 
-		write_view_to_file(self.view, self.path)
+			write_view_to_file(self.view, self.path)
 		self.reopen_from_new_path()
 
 		self.cleanup()
 
+	def on_done(self, path):
+		target = expand_homedir(ensure_path_sep_at_end_of_folders(path))
+
+		# Moving a file onto itself, nothing to trash or move
+		view_file_name = self.view.file_name()
+		if view_file_name and os.path.exists(view_file_name) and same_file(view_file_name, target):
+			add_to_history(abbr_homedir(view_file_name))
+			if self.view.is_dirty():
+				self.resave()
+			else:
+				sublime.status_message('Already at: '+view_file_name)
+			self.window.run_command('hide_panel')
+			self.cleanup()
+			return
+
+		NoDialogsCreateCopyPromptCommand.on_done(self, path)
+
+class NoDialogsCreateSaveAllUntitledPromptCommand(sublime_plugin.ApplicationCommand):
+	def __init__(self):
+		self.window = None
+		self.views = None
+		self.basenames = None
+		self.jobs = None
+
+		sublime_plugin.ApplicationCommand.__init__(self)
+
+	def cleanup(self):
+		self.window = None
+		self.views = None
+		self.basenames = None
+		self.jobs = None
+
+		update_currently_open_prompt(None)
+
+	# Views with the same name get numbered ('untitled 2')
+	# Going by the listing is only a first guess, a name taken by the time of writing gets the next number then
+	def write_jobs(self, dirname):
+		try:
+			taken = set(file.rstrip(os.sep) for file in list_dir(dirname))
+		except OSError: # created when saving
+			taken = set()
+
+		jobs = []
+		for (view, basename) in zip(self.views, self.basenames):
+			number = 1
+			while numbered_name(basename, number) in taken:
+				number += 1
+			taken.add(numbered_name(basename, number))
+			jobs.append((view, dirname, basename, number))
+		return jobs
+
+	def finish_the_job(self):
+		jobs = self.jobs
+		def on_written(written):
+			for (view, path) in written:
+				window = view.window()
+				if window is not None: # closed while it was written
+					reopen_from_path(window, view, path)
+			sublime.status_message('Saved '+str(len(written))+' of '+str(len(jobs))+' files')
+
+		write_views_to_new_files(jobs, on_written)
+		self.cleanup()
+
+	def on_save_answer(self, answer):
+		if answer and 'Nn'.find(answer[0]) != -1:
+			self.cleanup()
+			return
+
+		self.finish_the_job()
+
+	def on_done(self, path):
+		dirname = expand_homedir(path)
+		if os.path.exists(dirname) and not os.path.isdir(dirname):
+			sublime.status_message('Not a folder: '+path)
+			self.cleanup()
+			return
+
+		add_to_history(abbr_homedir(ensure_path_sep_at_end(dirname)))
+
+		# The names every view is about to get, confirmed at once
+		self.jobs = self.write_jobs(dirname)
+		names = ', '.join(numbered_name(basename, number) for (_, __, basename, number) in self.jobs)
+		self.window.show_input_panel('Save as '+names+'? (defaults to y)', '', self.on_save_answer, modification_counter, self.cleanup)
+
+	def run(self):
+		self.cleanup()
+		set_currently_running_command('save')
+		self.window = sublime.active_window()
+
+		self.views = [view for view in self.window.views() if not can_resave(view) and view.is_dirty() and not view.is_scratch()]
+		if not self.views:
+			sublime.status_message('No untitled files to save')
+			self.cleanup()
+			return
+
+		# Every view is proposed the name the Save prompt would, all of them go to one folder
+		self.basenames = []
+		for view in self.views:
+			(dirname, basename) = probable_dirname_and_basename(self.window, view)
+			self.basenames.append(basename or config.untitled_file_name)
+
+		prefetch_path(dirname)
+		prompt = 'Save '+str(len(self.views))+' untitled files into:'
+		update_currently_open_prompt(self.window.show_input_panel(prompt, dirname, self.on_done, modification_counter, self.cleanup))
+
 
 #
 # Close commands
 #
+current_review = None # the close window or exit prompt going through views
+reviewed_views = {} # view id -> view, for every view current_review still has to ask about
+
 class NoDialogsCreateClosePromptCommand(sublime_plugin.ApplicationCommand):
 	def __init__(self):
 		self.window = None
@@ -602,6 +2256,9 @@ class NoDialogsCreateClosePromptCommand(sublime_plugin.ApplicationCommand):
 		self.last_focused_view = None
 		self.save_on_focus_lost_was = None
 
+		self.review_windows_list = None
+		self.review_queue = None
+
 		sublime_plugin.ApplicationCommand.__init__(self)
 
 	def cleanup(self):
@@ -627,7 +2284,11 @@ class NoDialogsCreateClosePromptCommand(sublime_plugin.ApplicationCommand):
 
 	def on_overwrite_answer(self, answer):
 		if not answer:
-			answer = settings.get(self.DISCARD_SETTING)
+			answer = getattr(config, self.DISCARD_SETTING)
+
+		if self.review_queue is not None:
+			self.on_review_answer(answer)
+			return
 
 		if 'Nn'.find(answer[0]) != -1:
 			self.cleanup()
@@ -635,82 +2296,162 @@ class NoDialogsCreateClosePromptCommand(sublime_plugin.ApplicationCommand):
 
 		self.finish_the_job()
 
-	def will_closing_discard(self, view):
+	def will_closing_discard(self, view, existing_files = None):
 		if view is None:
 			return False
+		if view.is_dirty():
+			return True
 
-		view_file_name = self.view.file_name()
-		return self.view.is_dirty() or view_file_name and not os.path.exists(view_file_name)
+		view_file_name = view.file_name()
+		if not view_file_name:
+			return False
+		if existing_files is None:
+			return not file_exists(view_file_name)
+		return not existing_files.get(view_file_name, True)
 
-	DISCARD_SETTING = 'no_dialogs_discard_by_default'
-	def show_discard_prompt(self):
+	DISCARD_SETTING = 'discard_by_default'
+	def show_discard_prompt(self, hint = ''):
 		view_settings = self.view.settings()
 		self.save_on_focus_lost_was = view_settings.get('save_on_focus_lost')
 		view_settings.set('save_on_focus_lost', False)
 
-		self.window.show_input_panel('Discard? (defaults to '+settings.get(self.DISCARD_SETTING)+')', '', self.on_overwrite_answer, modification_counter, self.cleanup)
+		self.window.show_input_panel('Discard? (defaults to '+getattr(config, self.DISCARD_SETTING)+hint+')', '', self.on_overwrite_answer, modification_counter, self.on_cancel)
 
-	def run(self):
-		self.alias_window_and_view()
+	def on_cancel(self):
+		self.cleanup()
+		self.end_review()
 
-		if self.will_closing_discard(self.view):
-			self.show_discard_prompt()
+	#
+	# Review of every view that closing several windows would discard (used by close window and exit)
+	# The views are found in one pass, then the event listener keeps the list up to date while the prompts are shown
+	REVIEW_HINT = '; a - discard all, s - save all'
+	def start_review(self):
+		global current_review
+		if current_review is not None:
+			current_review.end_review()
+		current_review = self
+
+		self.review_windows_list = self.review_windows()
+		views = [(window, view) for window in self.review_windows_list for view in window.views()]
+
+		# Files of clean views are all checked at once
+		existing_files = paths_exist([view.file_name() for (_, view) in views if view.file_name() and not view.is_dirty()])
+
+		self.review_queue = deque()
+		for (window, view) in views:
+			if self.will_closing_discard(view, existing_files):
+				self.queue_for_review(window, view)
+
+		self.review_next()
+
+	def queue_for_review(self, window, view):
+		self.review_queue.append((window, view))
+		reviewed_views[view.id()] = view
+
+	def end_review(self):
+		if self.review_queue is None:
 			return
 
-		self.window.run_command('close')
-
-class NoDialogsCreateCloseWindowPromptCommand(NoDialogsCreateClosePromptCommand):
-	DISCARD_SETTING = 'no_dialogs_discard_in_window_by_default'
-	def finish_the_job(self):
-		self.view.set_scratch(True)
-		self.view.settings().set('save_on_focus_lost', False)
+		global current_review
+		if current_review is self:
+			current_review = None
 
-		self.cleanup()
-		sublime.run_command('no_dialogs_create_close_window_prompt')
+		self.review_queue = None
+		self.review_windows_list = None
+		reviewed_views.clear()
 
-	def run(self):
-		self.window = sublime.active_window()
+	def review_next(self):
+		while self.review_queue:
+			(window, view) = self.review_queue[0]
+			if view.id() not in reviewed_views: # closed or saved meanwhile
+				self.review_queue.popleft()
+				continue
 
-		for view in self.window.views():
+			self.window = window
 			self.view = view
 
-			if not self.will_closing_discard(view):
-				continue
+			self.last_focused_view = window.active_view()
+			window.focus_view(view)
 
-			self.last_focused_view = self.window.active_view()
-			self.window.focus_view(view)
+			self.show_discard_prompt(self.REVIEW_HINT)
+			return # wait for input
 
-			self.show_discard_prompt()
-			return # wait for input, then start over
+		self.close_all()
+		self.end_review()
 
-		self.window.run_command('close_window')
+	def discard_view(self, view):
+		view.set_scratch(True)
+		view.settings().set('save_on_focus_lost', False)
 
-class NoDialogsCreateExitPromptCommand(NoDialogsCreateClosePromptCommand):
-	DISCARD_SETTING = 'no_dialogs_discard_on_exit_by_default'
-	def finish_the_job(self):
-		self.view.set_scratch(True)
-		self.view.settings().set('save_on_focus_lost', False)
+	def on_review_answer(self, answer):
+		if 'Nn'.find(answer[0]) != -1:
+			self.cleanup()
+			self.end_review()
+			return
 
+		review_queue = self.review_queue
 		self.cleanup()
-		sublime.run_command('no_dialogs_create_exit_prompt')
+
+		if 'Aa'.find(answer[0]) != -1:
+			for (_, view) in review_queue:
+				self.discard_view(view)
+			review_queue.clear()
+		elif 'Ss'.find(answer[0]) != -1:
+			# Untitled views have nowhere to be saved to, they are still asked about
+			for (window, view) in list(review_queue):
+				if view.file_name():
+					view.run_command('save')
+					review_queue.remove((window, view))
+					reviewed_views.pop(view.id(), None)
+		else:
+			self.discard_view(review_queue.popleft()[1])
+
+		self.review_next()
+
+	def on_review_view_changed(self, view):
+		if view.id() in reviewed_views or not view.is_dirty():
+			return
+
+		window = view.window()
+		if window is None:
+			return
+
+		for review_window in self.review_windows_list:
+			if review_window.id() == window.id():
+				self.queue_for_review(window, view)
+				return
 
 	def run(self):
-		for win in sublime.windows():
-			self.window = win
-			for view in self.window.views():
-				self.view = view
+		self.alias_window_and_view()
 
-				if not self.will_closing_discard(view):
-					continue
+		if self.will_closing_discard(self.view):
+			self.show_discard_prompt()
+			return
 
-				self.last_focused_view = self.window.active_view()
-				self.window.focus_view(view)
+		self.window.run_command('close')
 
-				self.show_discard_prompt()
-				return # wait for input, then start over
+class NoDialogsCreateCloseWindowPromptCommand(NoDialogsCreateClosePromptCommand):
+	DISCARD_SETTING = 'discard_in_window_by_default'
+	def review_windows(self):
+		return [sublime.active_window()]
 
+	def close_all(self):
+		self.review_windows_list[0].run_command('close_window')
+
+	def run(self):
+		self.start_review()
+
+class NoDialogsCreateExitPromptCommand(NoDialogsCreateClosePromptCommand):
+	DISCARD_SETTING = 'discard_on_exit_by_default'
+	def review_windows(self):
+		return sublime.windows()
+
+	def close_all(self):
 		sublime.run_command('exit')
 
+	def run(self):
+		self.start_review()
+
 
 #
 # Rest of the commands
@@ -732,15 +2473,15 @@ class NoDialogsCreateDeletePromptCommand(sublime_plugin.ApplicationCommand):
 		self.view = self.window.active_view()
 
 	def finish_the_job(self):
-		send2trash(self.view.file_name())
-		if settings.get('no_dialogs_close_on_deletion'):
+		trash([self.view.file_name()])
+		if config.close_on_deletion:
 			force_close_view(self.view)
 
 		self.cleanup()
 
 	def on_overwrite_answer(self, answer):
 		if not answer:
-			answer = settings.get('no_dialogs_delete_by_default')
+			answer = config.delete_by_default
 
 		if 'Nn'.find(answer[0]) != -1:
 			self.cleanup()
@@ -749,21 +2490,160 @@ class NoDialogsCreateDeletePromptCommand(sublime_plugin.ApplicationCommand):
 		self.finish_the_job()
 
 	def show_prompt(self):
-		self.window.show_input_panel('Delete? (defaults to '+settings.get('no_dialogs_delete_by_default')+')', '', self.on_overwrite_answer, modification_counter, self.cleanup)
+		self.window.show_input_panel('Delete? (defaults to '+config.delete_by_default+')', '', self.on_overwrite_answer, modification_counter, self.cleanup)
 
 	def run(self):
 		self.alias_window_and_view()
 
 		view_file_name = self.view.file_name()
-		if not view_file_name or not os.path.exists(view_file_name):
+		if not view_file_name or not file_exists(view_file_name):
 			sublime.run_command('no_dialogs_create_close_prompt')
 			return
 
-		if not settings.get('no_dialogs_delete_without_prompt'):
+		if not config.delete_without_prompt:
 			self.show_prompt()
 		else:
 			self.finish_the_job()
 
+# Like fnmatch, but a wildcard never matches a path separator: '~/proj/*' leaves out '~/proj/sub/file'
+def path_matches(path, pattern):
+	path_parts = os.path.normpath(path).split(os.sep)
+	pattern_parts = os.path.normpath(pattern).split(os.sep)
+	if len(path_parts) != len(pattern_parts):
+		return False
+
+	for (part, pattern_part) in zip(path_parts, pattern_parts):
+		if not fnmatch.fnmatch(part, pattern_part):
+			return False
+	return True
+
+class NoDialogsCreateDeleteManyPromptCommand(sublime_plugin.ApplicationCommand):
+	def __init__(self):
+		self.window = None
+		self.views = None
+
+		sublime_plugin.ApplicationCommand.__init__(self)
+
+	def cleanup(self):
+		self.window = None
+		self.views = None
+
+	def selected_views(self):
+		if not hasattr(self.window, 'selected_sheets'): # ST3 has no multiple tab selection
+			return []
+
+		views = []
+		for sheet in self.window.selected_sheets():
+			view = sheet.view()
+			if view is not None:
+				views.append(view)
+		return views
+
+	def finish_the_job(self):
+		paths = [view.file_name() for view in self.views]
+		trash(paths) # all files on one device go to trash in one go
+
+		if config.close_on_deletion:
+			for view in self.views:
+				force_close_view(view)
+
+		sublime.status_message('Deleted '+str(len(paths))+' files')
+		self.cleanup()
+
+	def on_overwrite_answer(self, answer):
+		if not answer:
+			answer = config.delete_by_default
+
+		if 'Nn'.find(answer[0]) != -1:
+			self.cleanup()
+			return
+
+		self.finish_the_job()
+
+	def show_prompt(self):
+		self.window.show_input_panel('Delete '+str(len(self.views))+' files? (defaults to '+config.delete_by_default+')', '', self.on_overwrite_answer, modification_counter, self.cleanup)
+
+	def confirm(self):
+		existing_files = paths_exist([view.file_name() for view in self.views if view.file_name()])
+		self.views = [view for view in self.views if existing_files.get(view.file_name())]
+		if not self.views:
+			sublime.status_message('Nothing to delete')
+			self.cleanup()
+			return
+
+		if config.delete_without_prompt and len(self.views) == 1:
+			self.finish_the_job()
+		else:
+			self.show_prompt() # always for more than one file
+
+	def on_pattern(self, pattern):
+		pattern = expand_homedir(pattern)
+		self.views = [view for view in self.window.views() if view.file_name() and path_matches(view.file_name(), pattern)]
+
+		self.confirm()
+
+	def run(self):
+		self.window = sublime.active_window()
+
+		selected_views = self.selected_views()
+		if len(selected_views) > 1:
+			self.views = selected_views
+			self.confirm()
+			return
+
+		# Otherwise delete the files of every open view matching a pattern, in the current file's folder by default
+		view = self.window.active_view()
+		view_file_name = view.file_name() if view is not None else None
+		if view_file_name:
+			default_text = os.path.join(abbr_homedir(os.path.dirname(view_file_name)), '*')
+		else:
+			default_text = os.path.join(HOMEDIR_ABBR, '*')
+
+		self.window.show_input_panel('Delete files of views matching:', default_text, self.on_pattern, modification_counter, self.cleanup)
+
+class NoDialogsRestoreFromTrashCommand(sublime_plugin.ApplicationCommand):
+	def restore(self, count):
+		(restored, in_the_way, failed) = restore_from_trash(count)
+		sublime.set_timeout(lambda: self.on_restored(restored, in_the_way, failed), 0)
+
+	def on_restored(self, restored, in_the_way, failed):
+		window = sublime.active_window()
+		for path in restored:
+			window.open_file(path)
+
+		if in_the_way is not None or failed is not None:
+			if in_the_way is not None:
+				message = 'Not restoring, file exists: '+in_the_way
+			else:
+				message = 'Could not restore '+failed[0]+': '+str(failed[1])
+				print('[NoDialogs] '+message)
+			if restored:
+				message = 'Restored '+str(len(restored))+' files. '+message
+		elif not restored:
+			message = 'Nothing to restore'
+		elif len(restored) == 1:
+			message = 'Restored: '+restored[0]
+		else:
+			message = 'Restored '+str(len(restored))+' files'
+		sublime.status_message(message)
+
+	def run(self, count = 1):
+		trasher.submit(self.restore, count) # queued behind files still being trashed, without blocking the UI
+
+class NoDialogsShowPerformanceStatsCommand(sublime_plugin.ApplicationCommand):
+	def run(self):
+		if not config.performance_stats and not perf_stats:
+			sublime.status_message('Performance stats are off, see no_dialogs_performance_stats')
+			return
+
+		window = sublime.active_window()
+		if ST2:
+			panel = window.get_output_panel('no_dialogs_stats')
+		else:
+			panel = window.create_output_panel('no_dialogs_stats')
+		panel.run_command('no_dialogs_replace_helper', {'new_text': format_perf_stats()})
+		window.run_command('show_panel', {'panel': 'output.no_dialogs_stats'})
+
 class NoDialogsCreateOpenPrompt(sublime_plugin.ApplicationCommand):
 	def __init__(self):
 		self.window = None
@@ -842,6 +2722,8 @@ class NoDialogsCreateOpenPrompt(sublime_plugin.ApplicationCommand):
 		prefix = abbr_homedir(prefix)
 
 		default_text = os.path.join(prefix, selected_text) if selected_text else prefix
+		prefetch_path(default_text)
+		refresh_project_index(self.window)
 		self.update_prompt(self.window.show_input_panel('Open:', default_text, self.on_done, modification_counter, self.on_cancel))
 
 		if selected_text:
@@ -865,25 +2747,38 @@ class NoDialogsCreateOpenPrompt(sublime_plugin.ApplicationCommand):
 currently_open_prompt = None
 currently_running_command = None
 class NoDialogsEventListener(sublime_plugin.EventListener):
+	def on_close(self, view):
+		reviewed_views.pop(view.id(), None)
+
+	def on_post_save(self, view):
+		reviewed_views.pop(view.id(), None)
+
+	def on_modified(self, view):
+		if current_review is not None:
+			current_review.on_review_view_changed(view)
+
 	def on_query_completions(self, view, prefix, locations):
-		if settings.get('no_dialogs_autocomplete_mode') != 'default':
+		if config.autocomplete_mode != 'default':
 			return
 		if currently_open_prompt is None or currently_open_prompt != view:
 			return
 
-		comps = autocomplete_file_name(read_view(view))
+		text = read_view(view)
+		comps = autocomplete_from_project_index(text)
+		if comps is None:
+			comps = autocomplete_file_name(text).first_page() # the popup can not page, typing more narrows it down instead
 		flags = 0
-		flags |= sublime.INHIBIT_WORD_COMPLETIONS if settings.get('no_dialogs_inhibit_word_completions') else 0
-		flags |= sublime.INHIBIT_EXPLICIT_COMPLETIONS if settings.get('no_dialogs_inhibit_explicit_completions') else 0
+		flags |= sublime.INHIBIT_WORD_COMPLETIONS if config.inhibit_word_completions else 0
+		flags |= sublime.INHIBIT_EXPLICIT_COMPLETIONS if config.inhibit_explicit_completions else 0
 
 		return ([[comp, comp] for comp in comps], flags)
 
 	def on_query_context(_, __, key, ___, ____, _____):
 		if key == 'no_dialogs_prompt_open' and currently_open_prompt is not None:
 			return True
-		elif key == 'no_dialogs_no_shell_like_autocomplete' and not settings.get('no_dialogs__shell_like_autocomplete'):
+		elif key == 'no_dialogs_no_shell_like_autocomplete' and config.no_shell_like_context:
 			return True
-		elif key == 'no_dialogs_right_arrow_override' and settings.get('no_dialogs_right_arrow_override') and currently_running_command in ['save', 'copy', 'move', 'open']:
+		elif key == 'no_dialogs_right_arrow_override' and config.right_arrow_override and currently_running_command in ['save', 'copy', 'move', 'open']:
 			return True
-		elif key == 'no_dialogs_allow_history' and settings.get('no_dialogs_allow_history') and currently_running_command in settings.get('no_dialogs_allow_history_in'):
+		elif key == 'no_dialogs_allow_history' and config.allow_history and currently_running_command in config.allow_history_in:
 			return True
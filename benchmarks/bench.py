@@ -0,0 +1,254 @@
+# Headless benchmarks for NoDialogs, run outside of Sublime Text against the stubs next to this file
+#
+#   python3 benchmarks/bench.py --output before.json
+#   python3 benchmarks/bench.py --compare before.json
+#
+# Everything happens in a temporary directory (synthetic folders, trash, plugin data)
+# Timings are in seconds, the fastest and the median of --repeat runs
+import os
+import sys
+import json
+import time
+import types
+import shutil
+import argparse
+import tempfile
+import platform
+import importlib
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIR = os.path.dirname(BENCH_DIR)
+
+def load_plugin(data_dir):
+	sys.path.insert(0, BENCH_DIR)
+	import sublime
+	sublime.data_dir = data_dir
+
+	# send2trash reads this when it is imported
+	os.environ['XDG_DATA_HOME'] = os.path.join(data_dir, 'share')
+
+	# Load as a package, like Sublime Text does, so the relative send2trash import works
+	package = types.ModuleType('NoDialogs')
+	package.__path__ = [PACKAGE_DIR]
+	sys.modules['NoDialogs'] = package
+
+	started_at = time.perf_counter()
+	plugin = importlib.import_module('NoDialogs.NoDialogs')
+	plugin.plugin_loaded()
+	import_time = time.perf_counter()-started_at
+
+	return (plugin, sublime.load_settings('NoDialogs.sublime-settings'), import_time)
+
+def measure(run, repeat, setup=None):
+	times = []
+	for _ in range(repeat):
+		if setup is not None:
+			setup()
+		started_at = time.perf_counter()
+		run()
+		times.append(time.perf_counter()-started_at)
+	times.sort()
+	return {'min': times[0], 'median': times[len(times)//2], 'runs': repeat}
+
+#
+# Cases
+#
+def make_dir(root, size):
+	dirname = os.path.join(root, 'dir-'+str(size))
+	os.makedirs(dirname)
+	for i in range(size):
+		if i % 100 == 0:
+			os.mkdir(os.path.join(dirname, 'folder_%07d' % i))
+		else:
+			open(os.path.join(dirname, 'file_%07d.txt' % i), 'w').close()
+	return dirname
+
+def bench_autocomplete(plugin, settings, root, sizes, repeat, results):
+	plugin.set_currently_running_command('save')
+
+	for size in sizes:
+		dirname = make_dir(root, size)
+		prefix_query = os.path.join(dirname, 'file_00001')
+		fuzzy_query = os.path.join(dirname, 'fl0001t')
+		name = '['+str(size)+']'
+
+		results['autocomplete_file_name cold '+name] = measure(lambda: plugin.autocomplete_file_name(prefix_query).first_page(), repeat, plugin.listing_cache.clear)
+		results['autocomplete_file_name prefix '+name] = measure(lambda: plugin.autocomplete_file_name(prefix_query).first_page(), repeat)
+		results['autocomplete_file_name empty '+name] = measure(lambda: plugin.autocomplete_file_name(dirname+os.sep).first_page(), repeat)
+		results['autocomplete_path prefix '+name] = measure(lambda: plugin.autocomplete_path(prefix_query).first_page(), repeat)
+
+		# Completing after every typed character
+		def type_query(query):
+			def run():
+				plugin.completion_session.reset()
+				for end in range(len(dirname)+2, len(query)+1):
+					plugin.autocomplete_file_name(query[:end]).first_page()
+			return run
+		results['autocomplete_file_name typing '+name] = measure(type_query(prefix_query), repeat)
+
+		settings.set('no_dialogs_autocomplete_matching', 'fuzzy')
+		results['autocomplete_file_name fuzzy '+name] = measure(lambda: plugin.autocomplete_file_name(fuzzy_query).first_page(), repeat)
+		results['autocomplete_path fuzzy '+name] = measure(lambda: plugin.autocomplete_path(fuzzy_query).first_page(), repeat)
+		results['autocomplete_file_name fuzzy typing '+name] = measure(type_query(fuzzy_query), repeat)
+		settings.set('no_dialogs_autocomplete_matching', 'prefix')
+
+		settings.set('no_dialogs_use_shell_like_autocomplete', True)
+		results['autocomplete_file_name shell-like '+name] = measure(lambda: plugin.autocomplete_file_name(prefix_query).first_page(), repeat)
+		settings.set('no_dialogs_use_shell_like_autocomplete', False)
+
+		plugin.listing_cache.clear()
+		shutil.rmtree(dirname)
+
+# Every history, so adds are always fresh ones whichever history no_dialogs_use_global_history picks
+def reset_histories(plugin):
+	for name in list(plugin.HISTORIES):
+		history = plugin.History(name)
+		plugin.HISTORIES[name] = history
+		setattr(plugin, name+'_history', history)
+
+def bench_history(plugin, settings, sizes, repeat, results):
+	import sublime
+
+	settings.set('no_dialogs_persist_history', False)
+	settings.set('no_dialogs_frecency_ranking', False)
+	plugin.set_currently_running_command('save')
+
+	for size in sizes:
+		settings.set('no_dialogs_history_max_size', size)
+		entries = ['~/project_%d/src/file_%07d.txt' % (i % 50, i) for i in range(size)]
+		name = '['+str(size)+']'
+
+		def add_all():
+			for entry in entries:
+				plugin.add_to_history(entry)
+		results['history add '+name] = measure(add_all, repeat, lambda: reset_histories(plugin))
+
+		# Up 100 times from a fresh prompt, with and without something typed
+		view = sublime.View()
+		def navigate():
+			for _ in range(100):
+				plugin.NoDialogsHistoryPreviousCommand(view).run(None)
+		def open_prompt(text):
+			def reset():
+				view.run_command('no_dialogs_replace_helper', {'new_text': text})
+				plugin.update_currently_open_prompt(view)
+			return reset
+		results['history navigation '+name] = measure(navigate, repeat, open_prompt(''))
+		results['history prefix navigation '+name] = measure(navigate, repeat, open_prompt('~/project_7/'))
+
+	reset_histories(plugin)
+
+def bench_write(plugin, root, sizes, repeat, results):
+	import sublime
+
+	line = 'Lorem ipsum dolor sit amet, consectetur adipiscing elit éè 中文\n'
+	for size in sizes:
+		view = sublime.View(line*(size//len(line)+1))
+		path = os.path.join(root, 'written', 'file-'+str(size)+'.txt')
+		results['write_view_to_file ['+str(size)+']'] = measure(lambda: plugin.write_view_to_file(view, path), repeat)
+		os.remove(path)
+
+def bench_trash(root, counts, repeat, results):
+	trash = importlib.import_module('NoDialogs.send2trash.plat_other')
+
+	for count in counts:
+		dirname = os.path.join(root, 'to-trash')
+
+		# Every file has the same name, so each one collides with all the ones trashed before it
+		paths = []
+		def create_files():
+			shutil.rmtree(os.path.join(os.environ['XDG_DATA_HOME'], 'Trash'), ignore_errors=True)
+			trash._created_dirs.clear()
+			trash._name_hints.clear()
+			del paths[:]
+			for i in range(count):
+				path = os.path.join(dirname, str(i), 'same name.txt')
+				os.makedirs(os.path.dirname(path))
+				open(path, 'w').close()
+				paths.append(path)
+		def trash_one_by_one():
+			for path in paths:
+				trash.send2trash(path)
+		def trash_all():
+			trash.send2trash_many(paths)
+		def cleanup():
+			shutil.rmtree(dirname, ignore_errors=True)
+			create_files()
+
+		name = '['+str(count)+']'
+		results['send2trash collisions '+name] = measure(trash_one_by_one, repeat, cleanup)
+		results['send2trash_many collisions '+name] = measure(trash_all, repeat, cleanup)
+		shutil.rmtree(dirname, ignore_errors=True)
+
+#
+# Comparing
+#
+def compare(results, baseline, threshold):
+	regressions = []
+	for name in sorted(results):
+		if name not in baseline:
+			continue
+		ratio = results[name]['median']/max(baseline[name]['median'], 1e-9)
+		mark = ''
+		if ratio > 1+threshold:
+			mark = '  REGRESSION'
+			regressions.append(name)
+		print('%-50s %10.6f -> %10.6f  x%.2f%s' % (name, baseline[name]['median'], results[name]['median'], ratio, mark))
+	return regressions
+
+def sizes_arg(text):
+	return [int(size) for size in text.split(',') if size]
+
+def main():
+	parser = argparse.ArgumentParser(description='Benchmark NoDialogs without Sublime Text')
+	parser.add_argument('--dir-sizes', type=sizes_arg, default=[1000, 10000, 100000], help='entries per synthetic folder, e.g. 1000,1000000')
+	parser.add_argument('--history-sizes', type=sizes_arg, default=[1000, 10000, 100000])
+	parser.add_argument('--write-sizes', type=sizes_arg, default=[1024*1024, 16*1024*1024, 64*1024*1024], help='buffer sizes in characters')
+	parser.add_argument('--trash-counts', type=sizes_arg, default=[100, 1000], help='files with the same name to trash')
+	parser.add_argument('--only', action='append', choices=['autocomplete', 'history', 'write', 'trash'], help='run only these groups')
+	parser.add_argument('--repeat', type=int, default=5)
+	parser.add_argument('--output', help='write the results as JSON here')
+	parser.add_argument('--compare', help='JSON from an earlier run to compare against')
+	parser.add_argument('--threshold', type=float, default=0.2, help='slowdown to report as a regression (0.2 = 20%%)')
+	args = parser.parse_args()
+
+	groups = args.only or ['autocomplete', 'history', 'write', 'trash']
+	root = tempfile.mkdtemp(prefix='nodialogs-bench-')
+	try:
+		(plugin, settings, import_time) = load_plugin(root)
+
+		results = {'import': {'min': import_time, 'median': import_time, 'runs': 1}}
+		if 'autocomplete' in groups:
+			bench_autocomplete(plugin, settings, root, args.dir_sizes, args.repeat, results)
+		if 'history' in groups:
+			bench_history(plugin, settings, args.history_sizes, args.repeat, results)
+		if 'write' in groups:
+			bench_write(plugin, root, args.write_sizes, args.repeat, results)
+		if 'trash' in groups and os.name == 'posix' and sys.platform != 'darwin':
+			bench_trash(root, args.trash_counts, args.repeat, results)
+
+		plugin.plugin_unloaded()
+	finally:
+		shutil.rmtree(root, ignore_errors=True)
+
+	report = {
+		'python': platform.python_version(),
+		'platform': platform.platform(),
+		'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+		'results': results
+	}
+	if args.output:
+		with open(args.output, 'w') as fd:
+			json.dump(report, fd, indent=2, sort_keys=True)
+
+	if args.compare:
+		with open(args.compare) as fd:
+			baseline = json.load(fd)['results']
+		if compare(results, baseline, args.threshold):
+			sys.exit(1)
+	elif not args.output:
+		json.dump(report, sys.stdout, indent=2, sort_keys=True)
+		print()
+
+if __name__ == '__main__':
+	main()
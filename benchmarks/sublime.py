@@ -0,0 +1,142 @@
+# Stand-in for Sublime Text's sublime module, just enough to run NoDialogs headless
+import os
+import re
+import json
+
+INHIBIT_WORD_COMPLETIONS = 8
+INHIBIT_EXPLICIT_COMPLETIONS = 16
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+data_dir = None # set by the benchmark runner, plugin data goes there
+
+def version():
+	return '3211'
+
+def platform():
+	return 'linux' if os.name == 'posix' else 'windows'
+
+def packages_path():
+	return os.path.join(data_dir, 'Packages')
+
+def cache_path():
+	return os.path.join(data_dir, 'Cache')
+
+# Callbacks run right away, there is no UI thread to hand them to
+def set_timeout(callback, delay=0):
+	callback()
+
+def set_timeout_async(callback, delay=0):
+	callback()
+
+def status_message(message):
+	pass
+
+def error_message(message):
+	print('[sublime] '+message)
+
+def windows():
+	return []
+
+def active_window():
+	return None
+
+class Region(object):
+	def __init__(self, a, b=None):
+		self.a = a
+		self.b = a if b is None else b
+
+	def begin(self):
+		return min(self.a, self.b)
+
+	def end(self):
+		return max(self.a, self.b)
+
+class Settings(object):
+	def __init__(self, values):
+		self.values = values
+		self.callbacks = {}
+
+	def get(self, key, default=None):
+		return self.values.get(key, default)
+
+	def set(self, key, value):
+		self.values[key] = value
+		for callback in list(self.callbacks.values()):
+			callback()
+
+	def add_on_change(self, tag, callback):
+		self.callbacks[tag] = callback
+
+	def clear_on_change(self, tag):
+		self.callbacks.pop(tag, None)
+
+loaded_settings = {}
+def load_settings(name):
+	if name not in loaded_settings:
+		with open(os.path.join(PACKAGE_DIR, name)) as fd:
+			text = re.sub(r'^\s*//.*$', '', fd.read(), flags=re.M)
+		loaded_settings[name] = Settings(json.loads(text))
+	return loaded_settings[name]
+
+class Selection(list):
+	def clear(self):
+		del self[:]
+
+	def add(self, region):
+		self.append(region)
+
+class View(object):
+	next_id = 1
+
+	def __init__(self, text='', file_name=None):
+		self.text = text
+		self.path = file_name
+		self.selection = Selection([Region(len(text))])
+		self.view_settings = Settings({})
+
+		self.view_id = View.next_id
+		View.next_id += 1
+
+	def id(self):
+		return self.view_id
+
+	def size(self):
+		return len(self.text)
+
+	def substr(self, region):
+		return self.text[region.begin():region.end()]
+
+	def replace(self, edit, region, text):
+		self.text = self.text[:region.begin()]+text+self.text[region.end():]
+
+	def sel(self):
+		return self.selection
+
+	def run_command(self, cmd, args=None):
+		if cmd == 'no_dialogs_replace_helper':
+			self.text = args['new_text']
+			self.selection = Selection([Region(len(self.text))])
+
+	def name(self):
+		return ''
+
+	def file_name(self):
+		return self.path
+
+	def encoding(self):
+		return 'UTF-8'
+
+	def line_endings(self):
+		return 'Unix'
+
+	def is_dirty(self):
+		return False
+
+	def is_scratch(self):
+		return False
+
+	def settings(self):
+		return self.view_settings
+
+	def window(self):
+		return None
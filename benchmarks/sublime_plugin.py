@@ -0,0 +1,14 @@
+# Stand-in for Sublime Text's sublime_plugin module, commands are plain classes
+class ApplicationCommand(object):
+	pass
+
+class WindowCommand(object):
+	def __init__(self, window):
+		self.window = window
+
+class TextCommand(object):
+	def __init__(self, view):
+		self.view = view
+
+class EventListener(object):
+	pass
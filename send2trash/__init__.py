@@ -7,8 +7,8 @@
 import sys
 
 if sys.platform == 'darwin':
-    from .plat_osx import send2trash
+    from .plat_osx import send2trash, send2trash_many
 elif sys.platform == 'win32':
-    from .plat_win import send2trash
+    from .plat_win import send2trash, send2trash_many
 else:
-    from .plat_other import send2trash
\ No newline at end of file
+    from .plat_other import send2trash, send2trash_many
\ No newline at end of file
@@ -42,3 +42,8 @@ def send2trash(path):
     opts = kFSFileOperationDefaultOptions
     op_result = FSMoveObjectToTrashSync(byref(fp), None, opts)
     check_op_result(op_result)
+
+def send2trash_many(paths):
+    for path in paths:
+        send2trash(path)
+    return [] # the system keeps track of trashed files
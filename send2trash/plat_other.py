@@ -17,6 +17,8 @@
 #import sys
 import os
 import os.path as op
+import errno
+import select
 from datetime import datetime
 import stat
 import shutil
@@ -36,7 +38,7 @@ TOPDIR_FALLBACK = '.Trash-' + str(uid)
 
 def is_parent(parent, path):
     path = op.realpath(path) # In case it's a symlink
-    parent = op.realpath(parent)
+    parent = _cached_realpath(parent)
     return path.startswith(parent)
 
 def format_date(date):
@@ -60,28 +62,110 @@ def check_create(dir):
     if not op.exists(dir):
         os.makedirs(dir, 0o700)
 
-def trash_move(src, dst, topdir=None):
-    filename = op.basename(src)
-    filespath = op.join(dst, FILES_DIR)
-    infopath = op.join(dst, INFO_DIR)
+def _cached_check_create(dir):
+    if dir not in _created_dirs:
+        check_create(dir)
+        _created_dirs.add(dir)
+
+# Counter to start probing from for each (info dir, file name), so trashing the
+# same name over and over does not probe every taken name again. It is only a
+# hint: the O_EXCL creation of the info file is what actually reserves a name,
+# which is also safe against other processes trashing at the same time.
+_name_hints = {}
+
+def reserve_trash_name(filespath, infopath, filename):
     base_name, ext = op.splitext(filename)
+    key = (infopath, filename)
 
-    counter = 0
-    destname = filename
-    while op.exists(op.join(filespath, destname)) or op.exists(op.join(infopath, destname + INFO_SUFFIX)):
+    counter = _name_hints.get(key, 0)
+    while True:
+        if counter == 0:
+            destname = filename
+        else:
+            destname = '%s %s%s' % (base_name, counter, ext)
         counter += 1
-        destname = '%s %s%s' % (base_name, counter, ext)
 
-    check_create(filespath)
-    check_create(infopath)
+        info_file = op.join(infopath, destname + INFO_SUFFIX)
+        try:
+            fd = os.open(info_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+            continue
+
+        if op.lexists(op.join(filespath, destname)):
+            # A trashed file without its info file, leave it alone
+            os.close(fd)
+            os.remove(info_file)
+            continue
+
+        _name_hints[key] = counter
+        return destname, fd
+
+def move_to_trash_dir(src, filespath, infopath):
+    destname, info_fd = reserve_trash_name(filespath, infopath, op.basename(src))
     try:
-        os.rename(src, op.join(filespath, destname))
+        try:
+            os.rename(src, op.join(filespath, destname))
+        except:
+            shutil.move(src, op.join(filespath, destname))
     except:
-        shutil.move(src, op.join(filespath, destname))
-    f = open(op.join(infopath, destname + INFO_SUFFIX), 'w')
+        os.close(info_fd)
+        os.remove(op.join(infopath, destname + INFO_SUFFIX))
+        raise
+    return destname, info_fd
+
+def move_to_trash_dir_or_recreate(src, filespath, infopath):
+    # The trash may have been emptied (rm -rf) since its directories were
+    # created, so on ENOENT they are checked again and it is retried once.
+    try:
+        return move_to_trash_dir(src, filespath, infopath)
+    except (IOError, OSError) as e:
+        if e.errno != errno.ENOENT:
+            raise
+    _created_dirs.discard(filespath)
+    _created_dirs.discard(infopath)
+    _cached_check_create(filespath)
+    _cached_check_create(infopath)
+    return move_to_trash_dir(src, filespath, infopath)
+
+def write_info(info_fd, src, topdir):
+    f = os.fdopen(info_fd, 'w')
     f.write(info_for(src, topdir))
     f.close()
 
+def trash_move(src, dst, topdir=None):
+    filespath = op.join(dst, FILES_DIR)
+    infopath = op.join(dst, INFO_DIR)
+
+    _cached_check_create(filespath)
+    _cached_check_create(infopath)
+    destname, info_fd = move_to_trash_dir_or_recreate(src, filespath, infopath)
+    write_info(info_fd, src, topdir)
+    return op.join(filespath, destname), op.join(infopath, destname + INFO_SUFFIX)
+
+def trash_move_many(srcs, dst, topdir=None):
+    filespath = op.join(dst, FILES_DIR)
+    infopath = op.join(dst, INFO_DIR)
+
+    _cached_check_create(filespath)
+    _cached_check_create(infopath)
+
+    # A path that can't be trashed doesn't stop the others, the first error is
+    # raised once the rest are done. Each info file is written and closed right
+    # after its move, so only one is ever open.
+    trashed = []
+    errors = []
+    for src in srcs:
+        try:
+            destname, info_fd = move_to_trash_dir_or_recreate(src, filespath, infopath)
+            write_info(info_fd, src, topdir)
+        except (IOError, OSError) as e:
+            errors.append(e)
+            continue
+        trashed.append((src, op.join(filespath, destname), op.join(infopath, destname + INFO_SUFFIX)))
+    return trashed, errors
+
 def find_mount_point(path):
     # Even if something's wrong, "/" is a mount point, so the loop will exit.
     # Use realpath in case it's a symlink
@@ -128,19 +212,48 @@ def find_ext_volume_trash(volume_root):
 def get_dev(path):
     return os.lstat(path).st_dev
 
-def send2trash(path):
-    #if not isinstance(path, str):
-    #    path = str(path, sys.getfilesystemencoding())
-    #if not op.exists(path):
-    #    raise OSError("File not found: %s" % path)
-    # ...should check whether the user has the necessary permissions to delete
-    # it, before starting the trashing operation itself. [2]
-    #if not os.access(path, os.W_OK):
-    #    raise OSError("Permission denied: %s" % path)
-    # if the file to be trashed is on the same device as HOMETRASH we
-    # want to move it there.
-    path_dev = get_dev(path)
+# Where files of a device get trashed is looked up once per device id. Mounting
+# or unmounting can change what a device id (or a path) refers to, so all of it
+# is forgotten whenever /proc/self/mountinfo reports a change: it polls with
+# POLLPRI | POLLERR after mounts change. Without it nothing is kept.
+_trash_locations = {} # device id -> (topdir, dest_trash)
+_realpaths = {}
+_created_dirs = set()
+_mounts_watch = None
+
+def _watch_mounts():
+    try:
+        f = open('/proc/self/mountinfo')
+        f.read()
+        poller = select.poll()
+        poller.register(f, select.POLLPRI | select.POLLERR)
+    except (IOError, OSError, AttributeError):
+        return False
+    return (f, poller)
+
+def _mounts_changed():
+    global _mounts_watch
+    if _mounts_watch is None:
+        _mounts_watch = _watch_mounts()
+        return True
+    if not _mounts_watch:
+        return True
 
+    f, poller = _mounts_watch
+    if not poller.poll(0):
+        return False
+    f.seek(0)
+    f.read() # until read again it keeps reporting the change
+    return True
+
+def _cached_realpath(path):
+    realpath = _realpaths.get(path)
+    if realpath is None:
+        realpath = op.realpath(path)
+        _realpaths[path] = realpath
+    return realpath
+
+def find_trash_location(path, path_dev):
     # If XDG_DATA_HOME or HOMETRASH do not yet exist we need to stat the
     # home directory, and these paths will be created further on if needed.
     trash_dev = get_dev(op.expanduser('~'))
@@ -154,4 +267,67 @@ def send2trash(path):
         if trash_dev != path_dev:
             raise OSError("Couldn't find mount point for %s" % path)
         dest_trash = find_ext_volume_trash(topdir)
-    trash_move(path, dest_trash, topdir)
+    return topdir, dest_trash
+
+def forget_stale_locations():
+    if _mounts_changed():
+        _trash_locations.clear()
+        _realpaths.clear()
+        _created_dirs.clear()
+
+def lookup_trash_location(path, path_dev):
+    location = _trash_locations.get(path_dev)
+    if location is None:
+        location = find_trash_location(path, path_dev)
+        _trash_locations[path_dev] = location
+    return location
+
+def send2trash(path):
+    #if not isinstance(path, str):
+    #    path = str(path, sys.getfilesystemencoding())
+    #if not op.exists(path):
+    #    raise OSError("File not found: %s" % path)
+    # ...should check whether the user has the necessary permissions to delete
+    # it, before starting the trashing operation itself. [2]
+    #if not os.access(path, os.W_OK):
+    #    raise OSError("Permission denied: %s" % path)
+    # if the file to be trashed is on the same device as HOMETRASH we
+    # want to move it there.
+    path_dev = get_dev(path)
+    forget_stale_locations()
+    topdir, dest_trash = lookup_trash_location(path, path_dev)
+    # Where it went, (trashed file, info file)
+    return trash_move(path, dest_trash, topdir)
+
+def send2trash_many(paths):
+    # Paths are grouped by trash directory, so each one is looked up and
+    # created once and all of its files are moved in one go.
+    # Returns (path, trashed file, info file) for every trashed path, if some
+    # couldn't be trashed the first error is raised with that list as .trashed
+    forget_stale_locations()
+
+    groups = {}
+    locations = []
+    errors = []
+    for path in paths:
+        try:
+            location = lookup_trash_location(path, get_dev(path))
+        except (IOError, OSError) as e:
+            errors.append(e)
+            continue
+        if location not in groups:
+            groups[location] = []
+            locations.append(location)
+        groups[location].append(path)
+
+    trashed = []
+    for location in locations:
+        topdir, dest_trash = location
+        group_trashed, group_errors = trash_move_many(groups[location], dest_trash, topdir)
+        trashed.extend(group_trashed)
+        errors.extend(group_errors)
+
+    if errors:
+        errors[0].trashed = trashed
+        raise errors[0]
+    return trashed
@@ -40,10 +40,14 @@ def send2trash(path):
     #    path = str(path, 'mbcs')
     #if not op.isabs(path):
     #    path = op.abspath(path)
+    send2trash_many([path])
+
+def send2trash_many(paths):
+    # pFrom takes any number of null terminated paths, ended by an extra null
     fileop = SHFILEOPSTRUCTW()
     fileop.hwnd = 0
     fileop.wFunc = FO_DELETE
-    fileop.pFrom = LPCWSTR(path + '\0')
+    fileop.pFrom = LPCWSTR(''.join(path + '\0' for path in paths) + '\0')
     fileop.pTo = None
     fileop.fFlags = FOF_ALLOWUNDO | FOF_NOCONFIRMATION | FOF_NOERRORUI | FOF_SILENT
     fileop.fAnyOperationsAborted = 0
@@ -53,4 +57,5 @@ def send2trash(path):
     if result:
         msg = "Couldn't perform operation. Error code: %d" % result
         raise OSError(msg)
+    return [] # the system keeps track of trashed files
 